@@ -0,0 +1,96 @@
+# External Modules
+from typing  import Any,List,Iterable,Iterator
+from os      import remove,replace,getpid
+from os.path import exists
+from hashlib import sha1
+from json    import dumps
+# Internal Modules
+from dbplot.incremental import encode
+'''
+Content addressing of rendered figures
+
+A figure's key hashes everything its HTML depends on: the plot spec, the
+source of the user function files, the binds, the render options and the
+query results (row count and checksum, or for incremental plots the saved
+watermark). The key is stored in a sidecar file next to the HTML, and a figure
+whose key matches is not rendered (or written) again.
+
+Query results are only hashed for figures which already have a sidecar: a
+figure drawn for the first time (or with --force) is stamped with a key of
+its other inputs, so it is rendered again, and keyed in full, next time.
+'''
+################################################################################
+
+def sources(pths : List[str]) -> str:
+    '''Hash of the contents of the user function files'''
+    h = sha1()
+    for pth in pths:
+        with open(pth,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def salt(funcpths : List[str], binds : list, **opts : Any) -> str:
+    '''Hash of the inputs shared by every plot of a run'''
+    return sha1(dumps([sources(funcpths), repr(binds), opts],
+                      sort_keys = True, default = str).encode()).hexdigest()
+
+def rowkey(rows : Any) -> str:
+    '''Row count and checksum of query results (rows, or a dict of columns)'''
+    h = sha1()
+    if isinstance(rows, dict):
+        n = len(next(iter(rows.values()), []))
+        for k,v in rows.items():
+            h.update(k.encode())
+            h.update(v.tobytes() if v.dtype != object else repr(v.tolist()).encode())
+    else:
+        n = 0
+        for r in rows:
+            h.update(repr(list(r.items())).encode())
+            n += 1
+    return '%d:%s' % (n, h.hexdigest())
+
+class Tap(object):
+    '''Pass through a stream of rows, computing their rowkey as they go'''
+    def __init__(self, rows : Iterable[dict]) -> None:
+        self.rows = rows
+        self.h    = sha1()
+        self.n    = 0
+
+    def __iter__(self) -> Iterator[dict]:
+        for r in self.rows:
+            self.h.update(repr(list(r.items())).encode())
+            self.n += 1
+            yield r
+
+    def key(self) -> str:
+        return '%d:%s' % (self.n, self.h.hexdigest())
+
+def key(salt : str, spec : dict, data : Any) -> str:
+    '''Key of a figure, given the run's salt, its spec (as given) and its data's key'''
+    return sha1(dumps([salt, spec, data], sort_keys = True, default = encode).encode()).hexdigest()
+
+def sidecar(filename : str) -> str:
+    return filename + '.sha1'
+
+def stamped(filename : str) -> bool:
+    '''Whether a figure was written with a key (so its results are worth hashing)'''
+    return exists(sidecar(filename))
+
+def fresh(filename : str, key : str, *others : str) -> bool:
+    '''Whether a figure (and any other outputs) were last written with this key'''
+    if not all(map(exists, (filename, sidecar(filename)) + others)):
+        return False
+    with open(sidecar(filename)) as f:
+        return f.read().strip() == key
+
+def stamp(filename : str, key : str) -> None:
+    '''Record the key a figure was written with'''
+    tmp = sidecar(filename) + '.%d.tmp' % getpid()
+    with open(tmp,'w') as f:
+        f.write(key)
+    replace(tmp, sidecar(filename))
+
+def forget(filename : str) -> None:
+    '''Ensure a figure is rendered again'''
+    if exists(sidecar(filename)):
+        remove(sidecar(filename))
@@ -0,0 +1,67 @@
+# External Modules
+from typing      import Any
+from argparse    import ArgumentParser
+from ast         import literal_eval
+from json        import dumps
+from http.client import HTTPConnection
+import socket
+import sys
+# Internal Modules
+from dbplot.parse import StoreDictKeyPair
+
+"""
+Thin client for dbplot.server: sends a render request and writes the response,
+so that each plot costs a round trip rather than a Python start up
+
+>>> python -m dbplot.client --plot jobs --binds 2019 --outpth jobs.html
+"""
+################################################################################
+class UnixHTTPConnection(HTTPConnection):
+    '''HTTP over a Unix socket'''
+    def __init__(self, pth : str, timeout : float = 600.) -> None:
+        super().__init__('localhost', timeout = timeout)
+        self.pth = pth
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.pth)
+
+def request(req : dict, host : str = '127.0.0.1', port : int = 8050, sock : str = '') -> bytes:
+    '''Response to a render request (raising on failure)'''
+    conn = UnixHTTPConnection(sock) if sock else HTTPConnection(host, port, timeout = 600.) # type: Any
+    try:
+        conn.request('POST', '/render', body = dumps(req).encode(),
+                     headers = {'Content-Type' : 'application/json'})
+        res  = conn.getresponse()
+        body = res.read()
+    finally:
+        conn.close()
+    if res.status != 200:
+        raise ValueError('dbplot server (%d): %s' % (res.status, body.decode()))
+    return body
+
+################################################################################
+parser = ArgumentParser(description = 'Request a figure from a running dbplot server')
+
+parser.add_argument('--plot',   required = True, type = str, help = 'Name of a plot spec known to the server')
+parser.add_argument('--binds',  default = '', type = str, help = 'Literal python code for binds if plot has a parameterized query (as for dbplot.main)')
+parser.add_argument('--args',   default = {}, action = StoreDictKeyPair, nargs = '+', metavar = 'KEY=VAL', help = 'Overrides for cosmetic keys of the plot spec')
+parser.add_argument('--format', default = 'html', choices = ['html','json'], help = 'Write the HTML page or the figure JSON')
+parser.add_argument('--outpth', default = '', type = str, help = 'Write the response to this file (default: stdout)')
+parser.add_argument('--host',   default = '127.0.0.1', type = str, help = 'Server host')
+parser.add_argument('--port',   default = 8050, type = int, help = 'Server port')
+parser.add_argument('--socket', default = '', type = str, help = 'Server Unix socket (instead of host/port)')
+
+if __name__ == '__main__':
+    args  = parser.parse_args()
+    binds = literal_eval(args.binds) if args.binds else []
+    if not isinstance(binds,list):
+        binds = [binds]
+    req   = dict(plot = args.plot, binds = binds, args = args.args, format = args.format)
+    body  = request(req, args.host, args.port, args.socket)
+    if args.outpth:
+        with open(args.outpth, 'wb') as f:
+            f.write(body)
+    else:
+        sys.stdout.buffer.write(body)
@@ -1,46 +1,360 @@
 # External Modules
-from typing  import List, Any
-from time    import sleep
-from os      import environ
-from os.path import exists
-from random  import random
-from pprint  import pformat
-from json    import load, dump
-from copy import deepcopy
-
-from psycopg2.extras import DictCursor               # type: ignore
-from psycopg2        import connect,Error                   # type: ignore
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT  # type: ignore
+from typing      import List, Dict, Tuple, Any, Iterator, AsyncIterator, Callable as C, Optional as O
+from time        import sleep, time
+from os          import environ, makedirs, replace, getpid
+from os.path     import exists, join, getmtime
+from hashlib     import sha1
+from gzip        import open as gzopen
+from pickle      import dump as pdump, load as pload
+from random      import random
+from uuid        import uuid4
+from json        import load, dump, dumps
+from copy        import deepcopy
+from threading   import Condition, Lock
+from contextlib  import contextmanager, asynccontextmanager
+from collections import deque, OrderedDict
+
+# psycopg2 is imported where it is used, so that loading this module stays cheap
 ################################################################################
 
 localuser = environ["USER"]
 Connection = Any
 
+class Pool(object):
+    """
+    Bounded, thread-safe pool of DB connections
+
+    - connections are opened lazily, never more than `maxconn` at once
+    - the first checkout warms up `minconn` connections
+    - connections are health-checked when checked out
+    - connections idle for more than `maxidle` seconds are closed
+    """
+    def __init__(self,
+                 mk      : C[[],Connection],
+                 maxconn : int   = 4,
+                 minconn : int   = 0,
+                 maxidle : float = 300.
+                ) -> None:
+        assert 0 <= minconn <= maxconn and maxconn > 0, (minconn,maxconn)
+        self.mk      = mk
+        self.maxconn = maxconn
+        self.minconn = minconn
+        self.maxidle = maxidle
+        self.idle    = deque() # type: deque ### (connection, time returned)
+        self.size    = 0       # number of open connections, idle or borrowed
+        self.warm    = False
+        self.closed  = False
+        self.cond    = Condition()
+
+    def __len__(self) -> int:
+        return self.size
+
+    #-------------------#
+    # Support functions #
+    #-------------------#
+    def _open(self) -> Connection:
+        '''Open a connection in a slot already reserved by incrementing size'''
+        try:
+            return self.mk()
+        except BaseException:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+
+    def _discard(self, conn : Connection) -> None:
+        '''Close a connection and free its slot (caller holds the lock)'''
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.size -= 1
+        self.cond.notify()
+
+    def _evict(self) -> None:
+        '''Close connections idle for more than maxidle (caller holds the lock)'''
+        now = time()
+        while self.idle and now - self.idle[0][1] > self.maxidle:
+            self._discard(self.idle.popleft()[0])
+
+    @staticmethod
+    def _healthy(conn : Connection) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cxn:
+                cxn.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    #---------------#
+    # 'Exposed API' #
+    #---------------#
+    def warmup(self) -> None:
+        '''Open connections until at least minconn exist'''
+        self.warm = True
+        while True:
+            with self.cond:
+                if self.closed or self.size >= self.minconn:
+                    return
+                self.size += 1
+            self.put(self._open())
+
+    def get(self) -> Connection:
+        '''Check out a healthy connection, waiting if maxconn are in use'''
+        if not self.warm:
+            self.warmup()
+        while True:
+            with self.cond:
+                assert not self.closed, 'Connection pool is closed'
+                self._evict()
+                while not self.idle and self.size >= self.maxconn:
+                    self.cond.wait()
+                    assert not self.closed, 'Connection pool is closed'
+                if not self.idle:
+                    self.size += 1
+                    break
+                conn = self.idle.pop()[0] # most recently returned first
+
+            if self._healthy(conn):
+                return conn
+            with self.cond:
+                self._discard(conn)
+
+        return self._open()
+
+    def put(self, conn : Connection) -> None:
+        '''Return a checked out connection'''
+        with self.cond:
+            if self.closed or conn.closed:
+                self._discard(conn)
+            else:
+                self.idle.append((conn, time()))
+                self.cond.notify()
+
+    def close(self) -> None:
+        '''Close idle connections; borrowed ones are closed when returned'''
+        with self.cond:
+            self.closed = True
+            while self.idle:
+                self._discard(self.idle.popleft()[0])
+            self.cond.notify_all()
+
+class ResultCache(object):
+    """
+    Cache of query results, keyed on the normalized query text, the binds and
+    the connection parameters
+
+    - the `size` most recently used results are kept in memory, up to about
+      `maxmem` bytes in total
+    - if `pth` is given, results are also stored there as compressed pickles
+    - results are reused for `ttl` seconds after they were fetched
+    - `mode` is one of 'use', 'refresh' (always re-run queries, storing their
+      results) or 'off'
+
+    The planner's estimates of query results (see `estimate`) are also kept
+    in memory for `ttl` seconds, whatever the mode.
+    """
+    modes = ['use','refresh','off']
+
+    def __init__(self,
+                 size   : int   = 32,
+                 pth    : str   = '',
+                 ttl    : float = 3600.,
+                 mode   : str   = 'use',
+                 maxmem : int   = 1 << 28
+                ) -> None:
+        assert mode in self.modes, 'Cache mode must be one of %s' % self.modes
+        self.size   = size
+        self.pth    = pth
+        self.ttl    = ttl
+        self.mode   = mode
+        self.maxmem = maxmem
+        self.mem    = OrderedDict() # type: OrderedDict ### key -> (rows, fetched at, bytes)
+        self.nbytes = 0
+        self.plans  = {} # type: Dict[str,Tuple[Tuple[float,int],float]] ### key -> (estimate, made at)
+        self.lock   = Lock()
+        if pth and mode != 'off':
+            makedirs(pth, exist_ok = True)
+
+    def __len__(self) -> int:
+        return len(self.mem)
+
+    @staticmethod
+    def key(conn : 'ConnectInfo', q : str, binds : list) -> str:
+        norm = ' '.join(q.split())
+        ids  = [conn.host, conn.port, conn.user, conn.db]
+        return sha1(dumps([norm, repr(binds), ids]).encode()).hexdigest()
+
+    def _file(self, key : str) -> str:
+        return join(self.pth, key + '.pkl.gz')
+
+    def get(self, key : str) -> O[List[dict]]:
+        '''Cached result (or None, if absent, expired or not using the cache)'''
+        if self.mode != 'use':
+            return None
+        with self.lock:
+            if key in self.mem:
+                rows, at, _ = self.mem[key]
+                if time() - at <= self.ttl:
+                    self.mem.move_to_end(key)
+                    return rows
+                self._forget(key)
+
+        pth = self._file(key)
+        if not self.pth or not exists(pth) or time() - getmtime(pth) > self.ttl:
+            return None
+        try:
+            at = getmtime(pth)
+            with gzopen(pth,'rb') as f:
+                rows = pload(f)
+        except (OSError, EOFError):
+            return None
+        self._remember(key, rows, at)
+        return rows
+
+    def has(self, key : str) -> bool:
+        '''Whether `get` would return a result (without loading it)'''
+        if self.mode != 'use':
+            return False
+        with self.lock:
+            if key in self.mem and time() - self.mem[key][1] <= self.ttl:
+                return True
+        pth = self._file(key)
+        return bool(self.pth) and exists(pth) and time() - getmtime(pth) <= self.ttl
+
+    def plan(self, key : str, est : O[Tuple[float,int]] = None) -> O[Tuple[float,int]]:
+        '''Store an estimate, if given, else the estimate stored (if recent)'''
+        with self.lock:
+            if est is not None:
+                self.plans[key] = (est, time())
+            elif key in self.plans and time() - self.plans[key][1] <= self.ttl:
+                return self.plans[key][0]
+        return est
+
+    def put(self, key : str, rows : Any) -> Any:
+        '''
+        Store a result (rows or a dict of columns), which is returned. Rows
+        kept in memory are copied to plain dicts (unless they already are).
+        '''
+        if self.mode == 'off':
+            return rows
+        n = nbytes(rows)
+        if n <= self.maxmem and rows and isinstance(rows, list) and not isinstance(rows[0], dict):
+            rows = [dict(r.items()) for r in rows]
+        self._remember(key, rows, n = n)
+        if self.pth:
+            tmp = self._file(key) + '.%d.tmp' % getpid()
+            with gzopen(tmp,'wb') as f:
+                pdump(rows, f)
+            replace(tmp, self._file(key))
+        return rows
+
+    def _remember(self, key : str, rows : Any, at : O[float] = None, n : O[int] = None) -> None:
+        n = nbytes(rows) if n is None else n
+        with self.lock:
+            if key in self.mem:
+                self._forget(key)
+            if n > self.maxmem:
+                return
+            self.mem[key] = (rows, time() if at is None else at, n)
+            self.nbytes  += n
+            while len(self.mem) > self.size or self.nbytes > self.maxmem:
+                self._forget(next(iter(self.mem)))
+
+    def _forget(self, key : str) -> None:
+        '''Drop a result from memory (holding the lock)'''
+        self.nbytes -= self.mem.pop(key)[2]
+
+    def clear(self) -> None:
+        '''Forget results held in memory'''
+        with self.lock:
+            self.mem.clear()
+            self.nbytes = 0
+
+def nbytes(rows : Any) -> int:
+    '''Approximate memory held by a result: rows (with `values`) or a dict of columns'''
+    from sys import getsizeof
+    if isinstance(rows, dict):
+        n = 0
+        for v in rows.values():
+            n += v.nbytes
+            if v.dtype == object and len(v):
+                n += len(v) * getsizeof(v[0])
+        return n
+    elif not rows:
+        return getsizeof(rows)
+    row = rows[0]
+    return len(rows) * (getsizeof(row) + sum(getsizeof(v) for v in row.values()))
+
 class ConnectInfo(object):
     """
     PostGreSQL connection info
+
+    Owns a lazily created pool of connections: use `borrow` to check one out
+    and `close` once done with the DB. Query results are cached if given a
+    ResultCache (the `cache` attribute).
+
+    The async API (`aborrow`, `aclose`) uses a separate pool of psycopg (3)
+    async connections, bound to the event loop which first uses it.
+
+    Guardrails (0 = no limit): plots whose queries are estimated to return
+    more than `maxrows` rows or `maxbytes` bytes are made cheaper or refused
+    (see Plot._preflight), and statements are cancelled after `timeout` seconds.
     """
     def __init__(self,
-                 host   : str = '127.0.0.1',
-                 port   : int = 5432,
-                 user   : str = None,
-                 passwd : str = None,
-                 db     : str = ''
+                 host    : str   = '127.0.0.1',
+                 port    : int   = 5432,
+                 user    : str   = None,
+                 passwd  : str   = None,
+                 db      : str   = '',
+                 maxconn : int   = 4,
+                 minconn : int   = 0,
+                 maxidle : float = 300.,
+                 copyrows: int   = 1000000,
+                 maxrows : int   = 0,
+                 maxbytes: int   = 0,
+                 timeout : float = 0.
                 ) -> None:
 
         if not user:
             user = passwd = environ["USER"]
 
-        self.host   = host
-        self.port   = port
-        self.user   = user
-        self.passwd = passwd
-        self.db     = db
+        self.host    = host
+        self.port    = port
+        self.user    = user
+        self.passwd  = passwd
+        self.db      = db
+        self.maxconn = maxconn
+        self.minconn = minconn
+        self.maxidle = maxidle
+        self.copyrows = copyrows # fetch with COPY if more rows are estimated (0: never)
+        self.maxrows  = maxrows
+        self.maxbytes = maxbytes
+        self.timeout  = timeout
+        self._pool   = None # type: O[Pool]
+        self._lock   = Lock()
+        self._cache  = None # type: O[ResultCache]
+        self._apool  = None # type: Any ### psycopg_pool.AsyncConnectionPool
+        self._aopen  = None # type: Any ### task opening the async pool
 
     def __str__(self) -> str:
-        return pformat(self.__dict__)
+        from pprint import pformat
+        return pformat(self.fields())
+
+    def fields(self) -> dict:
+        '''The (serializable) connection parameters'''
+        return {k:v for k,v in vars(self).items() if k[0] != '_'}
+
+    @property
+    def _options(self) -> str:
+        '''Server options for new connections (the statement timeout)'''
+        return '-c statement_timeout=%d' % (1000 * self.timeout) if self.timeout else ''
 
     def connect(self, attempt : int  = 3) -> Connection:
+        from psycopg2            import connect,Error                # type: ignore
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT  # type: ignore
         e = ''
         for _ in range(attempt):
             try:
@@ -49,6 +363,7 @@ class ConnectInfo(object):
                                user        = self.user,
                                password    = self.passwd,
                                dbname      = self.db,
+                               options     = self._options,
                                connect_timeout = 28800)
                 conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
                 return conn
@@ -58,10 +373,67 @@ class ConnectInfo(object):
 
         raise Error()
 
+    @property
+    def cache(self) -> O[ResultCache]:
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache : O[ResultCache]) -> None:
+        self._cache = cache
+
+    @property
+    def pool(self) -> Pool:
+        with self._lock:
+            if self._pool is None or self._pool.closed:
+                self._pool = Pool(self.connect, maxconn = self.maxconn,
+                                  minconn = self.minconn, maxidle = self.maxidle)
+            return self._pool
+
+    @contextmanager
+    def borrow(self) -> Iterator[Connection]:
+        '''Check out a pooled connection for the duration of a with block'''
+        pool = self.pool
+        conn = pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
+
+    def close(self) -> None:
+        '''Close the pooled connections'''
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+
+    @asynccontextmanager
+    async def aborrow(self) -> AsyncIterator[Connection]:
+        '''Check out a pooled async connection for the duration of an async with block'''
+        if self._apool is None:
+            from asyncio     import ensure_future
+            from psycopg_pool import AsyncConnectionPool # type: ignore
+            kwargs = dict(host = self.host, port = self.port, user = self.user,
+                          password = self.passwd, dbname = self.db, autocommit = True,
+                          options = self._options)
+            self._apool = AsyncConnectionPool('', kwargs = kwargs, open = False,
+                                              min_size = max(self.minconn, 1),
+                                              max_size = self.maxconn,
+                                              max_idle = self.maxidle)
+            self._aopen = ensure_future(self._apool.open())
+        await self._aopen
+        async with self._apool.connection() as conn:
+            yield conn
+
+    async def aclose(self) -> None:
+        '''Close the pooled async connections (before their event loop ends)'''
+        if self._apool is not None:
+            pool, self._apool = self._apool, None
+            await self._aopen
+            await pool.close()
+
     def to_file(self, pth : str) -> None:
         '''Store connectinfo data as a JSON file'''
         with open(pth,'w') as f:
-            dump(vars(self),f)
+            dump(self.fields(),f)
 
     @staticmethod
     def from_file(pth : str) -> 'ConnectInfo':
@@ -73,7 +445,8 @@ class ConnectInfo(object):
             return ConnectInfo(**load(f))
 
     def copy(self)->Any:
-        return deepcopy(self)
+        '''Copy of the connection info (with its own, empty, pool)'''
+        return ConnectInfo(**deepcopy(self.fields()))
 
     def neutral(self)->Connection:
         copy = self.copy()
@@ -104,12 +477,531 @@ class ConnectInfo(object):
             cxn.execute(createQ,vars=[self.db])
 
 
+class Sources(object):
+    """
+    Several PostGreSQL DBs with the same schema, queried as one: each query
+    runs on every source (in parallel) and their results are concatenated, in
+    the order the sources are given. Each source keeps its own pool.
+
+    If `column` is given, queries are tagged (see `tag`) so that their rows
+    carry the name of their source in that column, which plots can then group
+    by, even in SQL rewritten to aggregate or bin in the DB.
+
+    Limits (copyrows, maxrows, maxbytes) apply to the combined result, and
+    default to those of the first source.
+    """
+    marker = "'_dbplot_source_'" # replaced by the source's name in tagged queries
+
+    def __init__(self,
+                 sources  : List[Tuple[str,ConnectInfo]],
+                 column   : str = '',
+                 copyrows : O[int] = None,
+                 maxrows  : O[int] = None,
+                 maxbytes : O[int] = None
+                ) -> None:
+        assert sources, 'No sources given'
+        self.sources  = OrderedDict(sources)
+        assert len(self.sources) == len(sources), 'Source names must be unique'
+        first         = next(iter(self.sources.values()))
+        self.column   = column
+        self.copyrows = first.copyrows if copyrows is None else copyrows
+        self.maxrows  = first.maxrows  if maxrows  is None else maxrows
+        self.maxbytes = first.maxbytes if maxbytes is None else maxbytes
+
+    def __str__(self) -> str:
+        return '\n'.join('%s: %s' % (k,v) for k,v in self.sources.items())
+
+    @staticmethod
+    def from_entries(entries : List[dict], **kwargs : Any) -> 'Sources':
+        """
+        Create from ConnectInfo fields, each with an optional 'name' (default:
+        host:port/db)
+        """
+        srcs = []
+        for e in map(dict, entries):
+            name = e.pop('name', None)
+            src  = ConnectInfo(**e)
+            srcs.append((name or '%s:%s/%s' % (src.host, src.port, src.db), src))
+        return Sources(srcs, **kwargs)
+
+    # Identify the sources together (as a ConnectInfo's fields do)
+    @property
+    def host(self) -> List[str]: return [s.host for s in self.sources.values()]
+    @property
+    def port(self) -> List[int]: return [s.port for s in self.sources.values()]
+    @property
+    def user(self) -> List[str]: return [s.user for s in self.sources.values()]
+    @property
+    def db(self)   -> List[str]: return [s.db   for s in self.sources.values()]
+
+    @property
+    def maxconn(self) -> int:
+        return max(s.maxconn for s in self.sources.values())
+
+    @maxconn.setter
+    def maxconn(self, n : int) -> None:
+        for s in self.sources.values():
+            s.maxconn = n
+
+    @property
+    def cache(self) -> O[ResultCache]:
+        return next(iter(self.sources.values())).cache
+
+    @cache.setter
+    def cache(self, cache : O[ResultCache]) -> None:
+        for s in self.sources.values():
+            s.cache = cache # results are cached per source
+
+    def tag(self, q : str) -> str:
+        '''Add the source column to the results of a query'''
+        if not self.column:
+            return q
+        return 'SELECT *, %s AS %s FROM %s' % (self.marker, ident(self.column), subquery(q))
+
+    def untag(self, q : str, name : str) -> str:
+        '''A (possibly tagged) query as run on a source'''
+        return q.replace(self.marker, literal(name)) if self.column else q
+
+    def since(self, q : str, col : str, marks : Dict[str,Any]) -> str:
+        '''
+        Restrict a tagged query to rows with `col` greater than the mark of
+        their source (sources without a mark are not restricted)
+        '''
+        assert self.column, 'Watermarks of several sources need a source column'
+        cases = ['WHEN %s THEN %s > %s' % (literal(name), ident(col), literal(mark))
+                 for name, mark in marks.items() if mark is not None]
+        if not cases:
+            return q
+        return 'SELECT * FROM %s WHERE CASE %s %s ELSE true END' % (
+            subquery(q), self.marker, ' '.join(cases))
+
+    def run(self, f : C, q : str, binds : list, *args : Any) -> list:
+        '''Results of f(source, query, binds, *args) for every source, in parallel'''
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = [(s, self.untag(q, name)) for name, s in self.sources.items()]
+        with ThreadPoolExecutor(len(jobs)) as ex:
+            return list(ex.map(lambda j: f(j[0], j[1], binds, *args), jobs))
+
+    def close(self) -> None:
+        for s in self.sources.values():
+            s.close()
+
+    async def aclose(self) -> None:
+        for s in self.sources.values():
+            await s.aclose()
+
+def from_file(pth : str) -> Any:
+    """
+    ConnectInfo from a JSON file of its fields, or Sources from a JSON file
+    with a list of such entries (or {"sources": [...], "column": ..., ...})
+    """
+    assert exists(pth), 'Error loading connection info: no file at '+pth
+    with open(pth,'r') as f:
+        data = load(f)
+    if isinstance(data, list):
+        return Sources.from_entries(data)
+    elif 'sources' in data:
+        return Sources.from_entries(data.pop('sources'), **data)
+    return ConnectInfo(**data)
+
+def merged(iters : List[Iterator[dict]], chunk : int) -> Iterator[dict]:
+    """
+    Rows of several iterators, in order: all those of the first, then of the
+    second, etc. Each is consumed in its own thread, in chunks, so later ones
+    are fetched while earlier ones are read (with at most a few chunks per
+    iterator held in memory at once).
+    """
+    from queue     import Queue, Full
+    from threading import Thread, Event
+    queues, stop, done = [Queue(maxsize = 2) for _ in iters], Event(), object()
+
+    def put(queue : Queue, x : Any) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(x, timeout = 0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def pump(it : Iterator[dict], queue : Queue) -> None:
+        try:
+            rows = [] # type: List[dict]
+            for r in it:
+                rows.append(r)
+                if len(rows) >= chunk:
+                    if not put(queue, rows):
+                        return
+                    rows = []
+            put(queue, rows) and put(queue, done)
+        except BaseException as e:
+            put(queue, e)
+        finally:
+            getattr(it, 'close', lambda: None)()
+
+    threads = [Thread(target = pump, args = (it, queue), daemon = True)
+               for it, queue in zip(iters, queues)]
+    for t in threads:
+        t.start()
+    try:
+        for queue in queues:
+            while True:
+                x = queue.get()
+                if x is done:
+                    break
+                elif isinstance(x, BaseException):
+                    raise x
+                yield from x
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def cached(conn : ConnectInfo, q : str, binds : list = [], copy : bool = False) -> bool:
+    '''Whether the results of a query (fetched by COPY, if `copy`) are cached'''
+    if isinstance(conn, Sources):
+        return all(cached(s, conn.untag(q, name), binds, copy)
+                   for name, s in conn.sources.items())
+    cache = conn.cache
+    return cache is not None and cache.has(cache.key(conn, 'COPY ' + q if copy else q, binds))
+
 def select_dict(conn : ConnectInfo, q : str, binds : list = []) -> List[dict]:
-    with conn.connect().cursor(cursor_factory = DictCursor) as cxn: # type: ignore
+    from psycopg2        import Error      # type: ignore
+    from psycopg2.extras import DictCursor # type: ignore
+    if isinstance(conn, Sources):
+        return [r for rows in conn.run(select_dict, q, binds) for r in rows]
+    cache = conn.cache
+    if cache is not None:
+        key  = cache.key(conn, q, binds)
+        rows = cache.get(key)
+        if rows is not None:
+            return rows
+
+    with conn.borrow() as c, c.cursor(cursor_factory = DictCursor) as cxn: # type: ignore
         if 'group_concat' in q.lower():
             cxn.execute("SET SESSION group_concat_max_len = 100000")
         try:
             cxn.execute(q,vars=binds)
-            return cxn.fetchall()
+            rows = cxn.fetchall()
+        except Error as e:
+            raise ValueError('Query failed: '+q)
+
+    return cache.put(key, rows) if cache is not None else rows
+
+async def aselect_dict(conn : ConnectInfo, q : str, binds : list = []) -> List[dict]:
+    '''Async `select_dict`, sharing its ResultCache'''
+    from psycopg      import Error    # type: ignore
+    from psycopg.rows import dict_row # type: ignore
+    if isinstance(conn, Sources):
+        from asyncio import gather
+        res = await gather(*[aselect_dict(s, conn.untag(q, name), binds)
+                             for name, s in conn.sources.items()])
+        return [r for rows in res for r in rows]
+    cache = conn.cache
+    if cache is not None:
+        key  = cache.key(conn, q, binds)
+        rows = cache.get(key)
+        if rows is not None:
+            return rows
+
+    async with conn.aborrow() as c:
+        async with c.cursor(row_factory = dict_row) as cxn:
+            try:
+                await cxn.execute(q, binds)
+                rows = await cxn.fetchall()
+            except Error as e:
+                raise ValueError('Query failed: '+q)
+
+    return cache.put(key, rows) if cache is not None else rows
+
+def select_iter(conn     : ConnectInfo,
+                q        : str,
+                binds    : list = [],
+                itersize : int  = 2000
+               ) -> Iterator[dict]:
+    """
+    Lazily yield query results from a named (server-side) cursor, fetching
+    `itersize` rows per round trip so that the full result set is never held
+    in memory. The connection is returned to the pool once the generator is
+    exhausted or closed. Several sources are streamed concurrently.
+    """
+    from psycopg2        import Error      # type: ignore
+    from psycopg2.extras import DictCursor # type: ignore
+    if isinstance(conn, Sources):
+        yield from merged([select_iter(s, conn.untag(q, name), binds, itersize)
+                           for name, s in conn.sources.items()], itersize)
+        return
+    with conn.borrow() as c:
+        c.autocommit = False # named cursors only exist within a transaction
+        try:
+            with c.cursor(name = 'dbplot_' + uuid4().hex,
+                          cursor_factory = DictCursor) as cxn: # type: ignore
+                cxn.itersize = itersize
+                try:
+                    cxn.execute(q,vars=binds)
+                    yield from cxn
+                except Error as e:
+                    raise ValueError('Query failed: '+q)
+        finally:
+            if not c.closed:
+                c.rollback()
+                c.autocommit = True
+
+################################################################################
+# Query rewriting
+#----------------
+
+# Partial aggregates (name -> SQL expression template) from which each
+# supported aggregation can be computed, and merged across groups of rows
+# (see misc.aggregate). MIN and MAX keep the column's type, e.g. dates.
+partials = {'sum' : 'SUM(%s::float8)',
+            'n'   : 'COUNT(%s)',
+            'sq'  : 'SUM((%s::float8)^2)',
+            'min' : 'MIN(%s)',
+            'max' : 'MAX(%s)'}
+
+aggs = {'avg'    : ['sum','n'],
+        'sum'    : ['sum'],
+        'count'  : ['n'],
+        'min'    : ['min'],
+        'max'    : ['max'],
+        'stddev' : ['sum','n','sq']}
+
+def ident(name : str) -> str:
+    '''Quote a SQL identifier'''
+    return '"%s"' % name.replace('"','""')
+
+def subquery(q : str) -> str:
+    '''Wrap a query so that it can be selected from'''
+    return '(%s) AS _dbplot_q' % q.strip().rstrip(';')
+
+def aggregate_query(q : str, groupcols : List[str], col : str, agg : str) -> str:
+    """
+    Rewrite a query into a GROUP BY over `groupcols`, computing the partial
+    aggregates needed for `agg` over `col` (as columns named _<partial>). Groups come out in the order that
+    they are first seen in the original query.
+    """
+    assert agg in aggs, 'Cannot compute %s in SQL' % agg
+    numbered = '(SELECT *, row_number() OVER () AS _dbplot_n FROM %s) AS _dbplot' % subquery(q)
+    cols     = [ident(c) for c in groupcols]
+    sels     = cols + [(partials[p] % ident(col)) + ' AS ' + ident('_'+p) for p in aggs[agg]]
+    group    = ' GROUP BY ' + ', '.join(cols) if cols else ''
+    return 'SELECT %s FROM %s%s ORDER BY MIN(_dbplot_n)' % (', '.join(sels), numbered, group)
+
+def range_query(q : str, col : str) -> str:
+    '''Query for the minimum and maximum (lo, hi) of a column'''
+    x = ident(col) + '::float8'
+    return 'SELECT MIN(%s) AS lo, MAX(%s) AS hi FROM %s' % (x, x, subquery(q))
+
+def bin_query(q         : str,
+              groupcols : List[str],
+              col       : str,
+              lo        : float,
+              hi        : float,
+              bins      : int
+             ) -> str:
+    """
+    Rewrite a query to count the values of `col` in each of `bins` equal width
+    bins over [lo, hi], per group. Returns columns _bin (1..bins) and _n, with
+    groups in the order they are first seen in the original query.
+    """
+    numbered = '(SELECT *, row_number() OVER () AS _dbplot_n FROM %s) AS _dbplot' % subquery(q)
+    x        = ident(col) + '::float8'
+    cols     = [ident(c) for c in groupcols]
+    bucket   = 'LEAST(width_bucket(%s, %r, %r, %d), %d) AS _bin' % (x, float(lo), float(hi), bins, bins)
+    sels     = cols + [bucket, 'COUNT(*) AS _n']
+    return 'SELECT %s FROM %s WHERE %s IS NOT NULL GROUP BY %s ORDER BY MIN(_dbplot_n)' % (
+        ', '.join(sels), numbered, ident(col), ', '.join(cols + ['_bin']))
+
+def sample_query(q : str, frac : float) -> str:
+    '''
+    Keep a random fraction of a query's rows (TABLESAMPLE only applies to
+    tables, not to the results of arbitrary queries)
+    '''
+    return 'SELECT * FROM %s WHERE random() < %r' % (subquery(q), float(frac))
+
+def literal(x : Any) -> str:
+    '''SQL literal for a Python value, safe to embed in a query that takes binds'''
+    from psycopg2.extensions import adapt # type: ignore
+    return adapt(x).getquoted().decode().replace('%','%%')
+
+def watermark_query(q : str, col : str, mark : Any) -> str:
+    '''Restrict a query to rows with `col` greater than `mark`'''
+    return 'SELECT * FROM %s WHERE %s > %s' % (subquery(q), ident(col), literal(mark))
+
+def columns(conn : ConnectInfo, q : str, binds : list = []) -> List[str]:
+    '''Names of the columns a query returns (without running it in full)'''
+    return [name for name,_ in coltypes(conn, q, binds)]
+
+def coltypes(conn : ConnectInfo, q : str, binds : list = []) -> List[Tuple[str,int]]:
+    '''Names and type OIDs of the columns a query returns (without running it in full)'''
+    from psycopg2 import Error # type: ignore
+    if isinstance(conn, Sources):
+        name, src = next(iter(conn.sources.items()))
+        return coltypes(src, conn.untag(q, name), binds)
+    with conn.borrow() as c, c.cursor() as cxn:
+        try:
+            cxn.execute('SELECT * FROM %s LIMIT 0' % subquery(q), vars=binds)
+        except Error as e:
+            raise ValueError('Query failed: '+q)
+        return [(d[0], d[1]) for d in cxn.description]
+
+################################################################################
+# Bulk fetching
+#--------------
+def estimate(conn : ConnectInfo, q : str, binds : list = []) -> Tuple[float,int]:
+    '''
+    The planner's estimate of the rows a query returns and their width (bytes),
+    kept by the ResultCache (if any) so each query is only explained once
+    '''
+    from psycopg2 import Error # type: ignore
+    if isinstance(conn, Sources):
+        ests = conn.run(estimate, q, binds)
+        return sum(r for r,_ in ests), max(w for _,w in ests)
+    cache = conn.cache
+    if cache is not None:
+        key = cache.key(conn, 'EXPLAIN ' + q, binds)
+        est = cache.plan(key)
+        if est is not None:
+            return est
+    with conn.borrow() as c, c.cursor() as cxn:
+        try:
+            cxn.execute('EXPLAIN (FORMAT JSON) ' + q, vars=binds)
         except Error as e:
             raise ValueError('Query failed: '+q)
+        plan = cxn.fetchone()[0][0]['Plan']
+    est = float(plan['Plan Rows']), int(plan['Plan Width'])
+    if cache is not None:
+        cache.plan(key, est)
+    return est
+
+# Postgres type OIDs decoded by select_columns
+intoids    = {20, 21, 23}     # int8, int2, int4
+floatoids  = {700, 701, 1700} # float4, float8, numeric
+booloid    = 16
+numericoid = 1700
+
+# Binary format of the fixed width types (numeric is fetched as float8)
+fixed     = {16:'?', 20:'>i8', 21:'>i2', 23:'>i4', 700:'>f4', 701:'>f8'}
+signature = b'PGCOPY\n\xff\r\n\x00'
+
+def decodable(types : List[Tuple[str,int]]) -> bool:
+    '''Whether columns of these types are fetched by COPY as they would be as rows'''
+    return all(oid in fixed for _,oid in types)
+
+escapes = {'b':'\b','f':'\f','n':'\n','r':'\r','t':'\t','v':'\v'}
+
+def unescape(s : str) -> str:
+    '''Undo the backslash escapes of COPY's text format'''
+    if '\\' not in s:
+        return s
+    out, chars = [], iter(s)
+    for ch in chars:
+        if ch == '\\':
+            nxt = next(chars, '')
+            out.append(escapes.get(nxt, nxt))
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+def nulled(vals : Any, null : Any) -> Any:
+    '''A column with None where NULL (as an object array, if there are any)'''
+    if not null.any():
+        return vals
+    vals = vals.astype(object)
+    vals[null] = None
+    return vals
+
+def decode(raw : Any, oid : int) -> Any:
+    '''Array for a column of raw COPY (text format) fields, given its type OID'''
+    import numpy as np # type: ignore
+    null = raw == b'\\N'
+    if oid in intoids or oid in floatoids:
+        vals = np.where(null, b'0', raw).astype(np.int64 if oid in intoids else np.float64)
+        return nulled(vals, null)
+    out = np.empty(len(raw), dtype = object)
+    if oid == booloid:
+        out[:] = [None if n else f == b't' for f,n in zip(raw,null)]
+    else:
+        out[:] = [None if n else unescape(f.decode()) for f,n in zip(raw,null)]
+    return out
+
+def binary_query(q : str, types : List[Tuple[str,int]]) -> str:
+    '''
+    Rewrite a query for COPY BINARY so that every field has a fixed width:
+    each column is followed by a flag for NULLs, which are replaced by 0
+    (and numerics are cast to float8)
+    '''
+    sels = []
+    for name, oid in types:
+        col   = ident(name) + ('::float8' if oid == numericoid else '')
+        sels += ["COALESCE(%s, '0')" % col, '%s IS NULL' % ident(name)]
+    return 'SELECT %s FROM %s' % (', '.join(sels), subquery(q))
+
+def unpack(data : Any, types : List[Tuple[str,int]]) -> Dict[str,Any]:
+    '''Columns of the output of COPY BINARY for a `binary_query`'''
+    import numpy as np # type: ignore
+    fields = [('k','>i2')] # type: List[Tuple[str,str]]
+    for i, (_, oid) in enumerate(types):
+        fields += [('l%d' % i,'>i4'), ('v%d' % i, fixed[701 if oid == numericoid else oid]),
+                   ('m%d' % i,'>i4'), ('n%d' % i, '?')]
+    row = np.dtype(fields)
+    assert bytes(data[:11]) == signature, 'Not COPY BINARY output'
+    start   = 19 + int.from_bytes(bytes(data[15:19]), 'big') # after the header (extension)
+    n, rest = divmod(len(data) - start - 2, row.itemsize)    # before the trailer
+    assert not rest, 'Unexpected layout of COPY BINARY output'
+    rows = np.frombuffer(data, dtype = row, count = n, offset = start)
+    cols = OrderedDict() # type: Dict[str,Any]
+    for i, (name, _) in enumerate(types):
+        vals = rows['v%d' % i]
+        kind = vals.dtype.kind
+        vals = vals.astype(np.int64 if kind == 'i' else np.float64 if kind == 'f' else bool)
+        cols[name] = nulled(vals, rows['n%d' % i])
+    return cols
+
+def select_columns(conn : ConnectInfo, q : str, binds : list = []) -> Dict[str,Any]:
+    """
+    Query results as one NumPy array per column, fetched with COPY rather than
+    as rows. Columns with NULLs are object arrays, with None for NULL.
+
+    If every column is a boolean, integer, float or numeric, results are
+    fetched in binary format and unpacked in bulk, without making a Python
+    object per value: columns are as they would be as rows, except that
+    numerics become floats (see `decodable`). Otherwise, results are fetched
+    in text format, and other types are kept as Postgres prints them, except
+    booleans.
+    """
+    from io       import BytesIO
+    from psycopg2 import Error # type: ignore
+    import numpy as np         # type: ignore
+    if isinstance(conn, Sources):
+        parts = conn.run(select_columns, q, binds)
+        return OrderedDict((k, np.concatenate([p[k] for p in parts])) for k in parts[0])
+    cache = conn.cache
+    if cache is not None:
+        key  = cache.key(conn, 'COPY ' + q, binds) # see `cached`
+        cols = cache.get(key)
+        if cols is not None:
+            return cols
+
+    desc   = coltypes(conn, q, binds)
+    binary = all(oid in fixed or oid == numericoid for _,oid in desc)
+    buf    = BytesIO()
+    with conn.borrow() as c, c.cursor() as cxn:
+        try:
+            sql = cxn.mogrify(binary_query(q, desc) if binary else q, binds).decode()
+            cxn.copy_expert('COPY (%s) TO STDOUT%s' % (sql, ' (FORMAT BINARY)' if binary else ''), buf)
+        except Error as e:
+            raise ValueError('Query failed: '+q)
+
+    if binary:
+        cols = unpack(buf.getbuffer(), desc)
+        return cache.put(key, cols) if cache is not None else cols
+
+    # Fields are tab separated, rows newline terminated (both escaped in values)
+    data   = buf.getvalue()
+    fields = data.replace(b'\t', b'\n').split(b'\n')[:-1] if data else []
+    raw    = np.array(fields, dtype = bytes).reshape(-1, len(desc))
+    cols   = OrderedDict((name, decode(raw[:,i], oid)) for i,(name,oid) in enumerate(desc))
+    return cache.put(key, cols) if cache is not None else cols
@@ -0,0 +1,73 @@
+# External Modules
+from typing import Any,Dict,Callable as C
+import numpy as np # type: ignore
+'''
+Downsampling of lines to a bounded number of points
+
+Each method takes x and y arrays (x sorted) and a target number of points,
+returning the (sorted) indices of the points to keep, which always include
+the first and last points.
+'''
+################################################################################
+
+def numeric(x : Any) -> np.ndarray:
+    '''x as floats, or positions if not numeric (e.g. dates or strings)'''
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.number):
+        return x.astype(float)
+    try:
+        return x.astype(float)
+    except (TypeError, ValueError):
+        return np.arange(len(x), dtype = float)
+
+def stride(x : np.ndarray, y : np.ndarray, n : int) -> np.ndarray:
+    '''Every (N/n)th point'''
+    return np.unique(np.linspace(0, len(x) - 1, max(n, 2)).round().astype(int))
+
+def minmax(x : np.ndarray, y : np.ndarray, n : int) -> np.ndarray:
+    '''The minimum and maximum y of each of n/2 equal sized buckets'''
+    N       = len(y)
+    buckets = max(n // 2, 1)
+    edges   = np.linspace(0, N, buckets + 1).astype(int)
+    ids     = np.repeat(np.arange(buckets), np.diff(edges))
+    order   = np.lexsort((y, ids)) # by bucket, then by y (NaNs last)
+    lo, hi  = order[edges[:-1]], order[edges[1:] - 1]
+    return np.unique(np.concatenate([[0, N - 1], lo, hi]))
+
+def lttb(x : np.ndarray, y : np.ndarray, n : int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets (Steinarsson, 2013): split the points
+    between the first and last into n-2 buckets and from each keep the point
+    making the largest triangle with the previously kept point and the mean of
+    the next bucket
+    """
+    N = len(x)
+    if n < 3:
+        return stride(x, y, n)
+    edges = np.linspace(1, N - 1, n - 1).astype(int)
+    out   = np.empty(n, dtype = int)
+    out[0], out[-1] = 0, N - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi   = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else N)
+        cx, cy   = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area     = np.abs((x[a] - cx) * (y[lo:hi] - y[a])
+                          - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.nanargmax(area)) if not np.isnan(area).all() else lo
+        out[i + 1] = a
+    return out
+
+methods = {'lttb' : lttb, 'minmax' : minmax, 'stride' : stride} # type: Dict[str,C]
+
+def decimate(x : Any, y : Any, n : int, method : str = 'lttb') -> np.ndarray:
+    '''Indices of at most ~n points of the line (x, y) to draw'''
+    assert method in methods, 'decimate must be one of %s' % sorted(methods)
+    N = len(x)
+    if N <= n:
+        return np.arange(N)
+    try:
+        yf = np.asarray(y, dtype = float)
+    except (TypeError, ValueError):
+        return stride(x, y, n) # no notion of shape for non-numeric y
+    return methods[method](numeric(x), yf, n)
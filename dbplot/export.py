@@ -0,0 +1,111 @@
+# External Modules
+from typing      import Any,Dict,Iterable,Iterator,List,Sequence,Tuple
+from collections import OrderedDict
+from os.path     import splitext
+import csv
+import numpy as np # type: ignore
+'''
+Export of the data behind a figure, as CSV, Parquet or Arrow (IPC) files
+
+Input is an iterable of (group label, columns) pairs, as given by Plot.tables,
+which is written in chunks of at most `chunksize` rows. The names of the
+columns are also given, for a file to be written even if there are no groups.
+'''
+################################################################################
+chunksize = 65536
+
+Tables = Iterable[Tuple[str,Dict[str,Any]]]
+
+def chunks(tables : Tables) -> Iterator[Dict[str,np.ndarray]]:
+    '''Columns (led by the group label) of at most `chunksize` rows'''
+    for label, cols in tables:
+        cols = OrderedDict((k,np.asarray(v)) for k,v in cols.items())
+        n    = len(next(iter(cols.values()), []))
+        for i in range(0, n, chunksize):
+            chunk = OrderedDict((k,v[i:i+chunksize]) for k,v in cols.items())
+            m     = len(next(iter(chunk.values())))
+            group = np.empty(m, dtype = object)
+            group[:] = [label] * m
+            yield OrderedDict([('group',group)] + list(chunk.items()))
+
+def write_csv(tables : Tables, pth : str, columns : Sequence[str] = ()) -> None:
+    with open(pth, 'w', newline = '') as f:
+        w = csv.writer(f)
+        i = -1
+        for i, c in enumerate(chunks(tables)):
+            if i == 0:
+                w.writerow(list(c))
+            w.writerows(zip(*[v.tolist() for v in c.values()]))
+        if i < 0 and columns:
+            w.writerow(['group'] + list(columns))
+
+def _type(pa : Any, cols : List[np.ndarray]) -> Any:
+    '''Arrow type of a column, given its arrays in every table (strings, if mixed)'''
+    cols = [c for c in cols if len(c)]
+    if not cols:
+        return pa.null()
+    elif all(c.dtype != object for c in cols):
+        try:
+            return pa.from_numpy_dtype(np.result_type(*cols))
+        except (TypeError, pa.ArrowNotImplementedError):
+            return pa.string()
+    types = set()
+    for c in cols:
+        try:
+            types.add(pa.infer_type(c.tolist()))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.string()
+    types.discard(pa.null())
+    if len(types) > 1 and all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return types.pop() if len(types) == 1 else pa.string() if types else pa.null()
+
+def _schema(pa : Any, tables : List[Tuple[str,Dict[str,Any]]], columns : Sequence[str]) -> Any:
+    '''Schema of the whole file, fixed from the columns of every table before writing'''
+    labels = [np.array([label], dtype = object) for label, _ in tables]
+    names  = list(tables[0][1]) if tables else list(columns)
+    fields = [('group', _type(pa, labels) if tables else pa.string())]
+    for k in names:
+        fields.append((k, _type(pa, [np.asarray(cols[k]) for _, cols in tables])))
+    return pa.schema(fields)
+
+def _array(pa : Any, v : np.ndarray, typ : Any) -> Any:
+    '''Arrow array of a type for a column (as strings, if the column is of mixed type)'''
+    if pa.types.is_null(typ):
+        return pa.nulls(len(v))
+    elif pa.types.is_string(typ) and v.dtype.kind not in 'US':
+        return pa.array([None if x is None else str(x) for x in v.tolist()], type = typ)
+    return pa.array(v.tolist() if v.dtype == object else v, type = typ)
+
+def write_arrow(tables  : Tables,
+                pth     : str,
+                parquet : bool = True,
+                columns : Sequence[str] = ()
+               ) -> None:
+    '''Write a Parquet file, or an Arrow IPC file if not `parquet`'''
+    try:
+        import pyarrow as pa           # type: ignore
+        import pyarrow.parquet as pq   # type: ignore
+    except ImportError:
+        raise ValueError('Exporting to %s requires pyarrow' % pth)
+    tables = list(tables) # (the columns are already in memory)
+    schema = _schema(pa, tables, columns)
+    writer = pq.ParquetWriter(pth, schema) if parquet else pa.ipc.new_file(pth, schema)
+    try:
+        for c in chunks(tables):
+            arrays = [_array(pa, v, t) for v, t in zip(c.values(), schema.types)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema = schema))
+    finally:
+        writer.close()
+
+formats = OrderedDict([('csv', write_csv),
+                       ('parquet', write_arrow),
+                       ('arrow', lambda tables, pth, columns = ():
+                                     write_arrow(tables, pth, parquet = False, columns = columns))])
+
+def write(tables : Tables, pth : str, columns : Sequence[str] = ()) -> None:
+    '''Write in the format given by the file extension (see `formats`)'''
+    ext = splitext(pth)[1].lstrip('.').lower()
+    if ext not in formats:
+        raise ValueError('Cannot export to %s: extension must be one of %s' % (pth, list(formats)))
+    formats[ext](tables, pth, columns = columns)
@@ -0,0 +1,77 @@
+# External Modules
+from typing  import Any,List,Optional as O
+from os      import makedirs,replace,getpid
+from os.path import exists,dirname
+from hashlib import sha1
+from json    import dumps
+from gzip    import open as gzopen
+from pickle  import dump,load
+'''
+Incremental refresh of plots
+
+A plot whose spec has a `watermark` column keeps the groups it drew, along
+with the greatest watermark seen. The next refresh only queries rows past
+that watermark and merges them into the saved groups. Rows from several
+sources (see db.Sources) have a watermark per source.
+'''
+################################################################################
+
+# Plot keys which do not affect the grouped data
+cosmetic = {'title','xlab','ylab','frame','square','scatter','stream',
+            'maxpoints','decimate','webgl','bins','norm'}
+
+def encode(x : Any) -> str:
+    '''A spec value as a string which is the same in every process (functions by name)'''
+    if callable(x):
+        return '%s.%s' % (getattr(x,'__module__',''), getattr(x,'__qualname__',type(x).__name__))
+    return str(x)
+
+def fingerprint(spec  : dict,
+                binds : list,
+                conn  : Any,
+                cols  : List[str],
+                funcs : str = ''
+               ) -> str:
+    """
+    Identifies the data a plot's saved groups were computed from: the
+    (non-cosmetic) plot spec, as given, binds, DB, the query's columns
+    (schema) and the hash of the user function files that processed them
+    """
+    spec = {k:encode(v) for k,v in spec.items() if k not in cosmetic}
+    ids  = [conn.host, conn.port, conn.user, conn.db]
+    return sha1(dumps([spec, repr(binds), ids, cols, funcs], sort_keys = True).encode()).hexdigest()
+
+def later(a : Any, b : Any) -> Any:
+    '''The greater of two watermarks, either of which may be None'''
+    return a if b is None or (a is not None and a > b) else b
+
+class State(object):
+    """
+    Saved groups of a plot, in a compressed pickle at `pth`. If `rebuild`,
+    saved groups are ignored (but still overwritten). `funcs` is the hash of
+    the user function files of the run (see artifact.sources): groups saved
+    with other functions are not reused.
+    """
+    def __init__(self, pth : str, rebuild : bool = False, funcs : str = '') -> None:
+        self.pth     = pth
+        self.rebuild = rebuild
+        self.funcs   = funcs
+
+    def load(self, key : str) -> O[dict]:
+        '''Saved state (watermark, groups), if it was saved for the same key'''
+        if self.rebuild or not exists(self.pth):
+            return None
+        try:
+            with gzopen(self.pth,'rb') as f:
+                state = load(f)
+        except (OSError, EOFError):
+            return None
+        return state if state.get('key') == key else None
+
+    def save(self, key : str, watermark : Any, groups : list) -> None:
+        if dirname(self.pth):
+            makedirs(dirname(self.pth), exist_ok = True)
+        tmp = self.pth + '.%d.tmp' % getpid()
+        with gzopen(tmp,'wb') as f:
+            dump(dict(key = key, watermark = watermark, groups = groups), f)
+        replace(tmp, self.pth)
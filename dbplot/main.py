@@ -1,28 +1,182 @@
 # External Modules
-from typing            import Any
+from typing            import Any,Dict,List,Tuple,Iterable,TYPE_CHECKING
+from collections       import OrderedDict
 from os                import environ,listdir
-from os.path           import isdir,join,basename
+from os.path           import isdir,join,basename,splitext
 from ast               import literal_eval
-from plotly.offline    import plot # type: ignore
-from jinja2            import Template
+from time              import perf_counter
 # Internal Modules
-from dbplot.plot     import Plot
-from dbplot.db       import ConnectInfo
+from dbplot.db       import ConnectInfo, ResultCache, from_file
 from dbplot.parse    import parser
-from dbplot.misc     import path_to_funcs
+from dbplot.profile  import Profile,print_sink,json_sink
+from dbplot.incremental import State
+from dbplot          import artifact
+if TYPE_CHECKING:
+    from dbplot.plot import Plot
 
 """
 CLI for visualizing data in a MySQL database
+
+Heavy dependencies (numpy, plotly, psycopg2 and the Plot classes) are imported
+on the code paths which need them, so that e.g. --help starts quickly: see
+scripts/startup.py for the import time budget.
 """
 ################################################################################
 fname = 'temp'
 
+Job = Tuple[str,'Plot',str] # spec name, plot, output filename
+
+def plan(jobs   : Iterable[Job],
+         db     : ConnectInfo,
+         binds  : list,
+         funcs  : dict,
+         failed : Dict[str,BaseException]
+        ) -> List[List[Job]]:
+    """
+    Batch plots by the SQL they need executed, so that each distinct query is
+    run once and its results shared by the batch (plots which stream their
+    results get a batch of their own). Failures are recorded in `failed`.
+    """
+    batches = OrderedDict() # type: Dict[Any,List[Job]]
+    for job in jobs:
+        name, p, _ = job
+        try:
+            q = p.query(db, binds, funcs)
+        except Exception as e:
+            failed[name] = e
+            continue
+        batches.setdefault((q,name) if p._itersize else q, []).append(job)
+    return list(batches.values())
+
+def figures(batch  : List[Job],
+            db     : ConnectInfo,
+            binds  : list,
+            funcs  : dict,
+            export : str = ''
+           ) -> List[Tuple[str,str,Any]]:
+    '''Query phase: (name, filename, figure dict or error) for a batch of plots'''
+    try:
+        rows = batch[0][1].fetch(db, binds)
+    except Exception as e:
+        return [(name, fn, e) for name, _, fn in batch]
+    return draw(batch, db, binds, funcs, rows, export)
+
+async def afigures(batch  : List[Job],
+                   db     : ConnectInfo,
+                   binds  : list,
+                   funcs  : dict,
+                   sem    : Any,
+                   export : str = ''
+                  ) -> List[Tuple[str,str,Any]]:
+    '''Async query phase (see `figures`), with at most `sem` queries in flight'''
+    from asyncio import get_running_loop
+    p = batch[0][1]
+    async with sem:
+        if p._itersize:
+            return await get_running_loop().run_in_executor(None, figures, batch, db, binds, funcs, export)
+        try:
+            rows = await p.afetch(db, binds)
+        except Exception as e:
+            return [(name, fn, e) for name, _, fn in batch]
+    return draw(batch, db, binds, funcs, rows, export)
+
+def agather(batches : List[List[Job]],
+            db      : ConnectInfo,
+            binds   : list,
+            funcs   : dict,
+            cap     : int,
+            export  : str = ''
+           ) -> List[Tuple[str,str,Any]]:
+    '''Query phase for every batch at once, with at most `cap` queries in flight'''
+    from asyncio import run, gather, Semaphore
+    async def go() -> List[Tuple[str,str,Any]]:
+        sem = Semaphore(cap)
+        try:
+            res = await gather(*[afigures(b, db, binds, funcs, sem, export) for b in batches])
+        finally:
+            await db.aclose()
+        return [x for r in res for x in r]
+    return run(go())
+
+def draw(batch  : List[Job],
+         db     : ConnectInfo,
+         binds  : list,
+         funcs  : dict,
+         rows   : Iterable[dict],
+         export : str = ''
+        ) -> List[Tuple[str,str,Any]]:
+    '''
+    (name, filename, figure dict or error) for a batch of plots sharing fetched
+    rows, also exporting the data drawn in the given format (if any). Plots
+    given a salt are keyed, and if unchanged since last written the figure is
+    None. Rows are only hashed if some figure has a key to compare with.
+    '''
+    rkey, tap = None, None
+    if any(p.salt is not None and not p._incremental and artifact.stamped(fn)
+           for _, p, fn in batch):
+        if isinstance(rows, (list, dict)):
+            rkey = artifact.rowkey(rows)
+        else:
+            rows = tap = artifact.Tap(rows)
+
+    out = [] # type: List[Tuple[str,str,Any]]
+    for name, p, fn in batch:
+        try:
+            also = [splitext(fn)[0] + '.' + export] if export else []
+            spec = dict(p.spec, type = p.typ) # as given, not with the defaults filled in
+            if p.salt is not None and rkey is not None and not p._incremental:
+                p.key = artifact.key(p.salt, spec, rkey)
+                if artifact.fresh(fn, p.key, *also):
+                    out.append((name, fn, None))
+                    continue
+            fig = p.fig(conn=db, binds = binds, funcs = funcs, results = rows)
+            if p.salt is not None and p.key is None:
+                if p._incremental:
+                    data = ['watermark', p.mark] # type: Any
+                else: # None if not hashed: the figure is keyed in full next time
+                    data = tap.key() if tap is not None else None
+                p.key = artifact.key(p.salt, spec, data)
+                if artifact.fresh(fn, p.key, *also):
+                    out.append((name, fn, None))
+                    continue
+            if export:
+                p.export(also[0])
+            out.append((name, fn, fig.to_dict()))
+        except Exception as e:
+            out.append((name, fn, e))
+    return out
+
+def render(fig : dict, filename : str, auto_open : bool, compact : bool = False) -> float:
+    '''
+    Render phase: serialize a figure to HTML (run in a worker process). Compact
+    output uses typed arrays and a plotly.js file shared by the directory.
+    '''
+    start = perf_counter()
+    if compact:
+        from dbplot.output import write_html
+        write_html(fig, filename, auto_open = auto_open)
+    else:
+        from plotly.offline import plot # type: ignore
+        plot(fig, filename=filename, include_mathjax='cdn', auto_open = auto_open)
+    return perf_counter() - start
+
 def main(args:dict)->None:
+    from dbplot.plot import Plot
+    from dbplot.misc import path_to_funcs
 
     # Get DB info
     #----------
     dbpth = args.get('db') or environ['DB_JSON']
-    db    = ConnectInfo.from_file(dbpth)
+    db    = from_file(dbpth)
+    jobs  = args.get('jobs') or 1
+    comp  = bool(args.get('compact'))
+    exp   = args.get('export') or ''
+    db.maxconn = max(db.maxconn, jobs) # enough connections for every thread
+    if args.get('aio'):
+        db.maxconn = max(db.maxconn, args.get('concurrency') or 8)
+    db.cache = ResultCache(pth  = args.get('cachedir',''),
+                           ttl  = args.get('cachettl',3600.),
+                           mode = args.get('cache','use'))
 
     # Add functions into namespace from user-specified files
     #-------------------------------------------------------
@@ -43,23 +197,116 @@ def main(args:dict)->None:
     filename = args['outpth'] or basename(pp).replace('.json','.html')
     if pp:
         if isdir(pp):
-            ps = [Plot.from_file(join(pp,x)) for x in listdir(pp) if x[-4:]=='json']
+            names = sorted(x for x in listdir(pp) if x[-4:]=='json')
+            ps    = [Plot.from_file(join(pp,x)) for x in names]
         else:
-            ps = [Plot.from_file(args['pltpth'])]
+            names = [basename(pp)]
+            ps    = [Plot.from_file(args['pltpth'])]
             for k,v in (args['args'] or {}).items():
-                ps[0].data[k] = v
+                ps[0].data[k] = ps[0].spec[k] = v
     else:
         assert args['type'], 'Did you forget to specify --pltpth?'
         plotter = Plot.pltdict()[args['type']]
+        names   = [args['type']]
         ps      = [plotter(query=args['query'], **args['args'])]
 
     if len(ps)>1:
-        plot_urls = [plot(p.fig(conn=db, binds = binds, funcs = funcs),
-                          filename='%s%d.html'%(filename,i),include_mathjax='cdn',auto_open = args['open']) for i,p in enumerate(ps)]
+        filenames = ['%s%d.html'%(filename,i) for i in range(len(ps))]
     else:
-        plot_urls = plot(ps[0].fig(conn=db, binds = binds, funcs = funcs),
-                          filename=filename,include_mathjax='cdn',auto_open = args['open'])
+        filenames = [filename]
+
+    # Instrument plots (a shared query is attributed to the first plot using it)
+    #---------------------------------------------------------------------------
+    prof = args.get('profile')
+    if prof:
+        sink = print_sink if prof == '-' else json_sink(prof)
+        for p in ps:
+            p.profile = Profile(sink)
+    plots = dict(zip(names, ps))
+
+    # Plots with a watermark column refresh incrementally, given somewhere to save state
+    #-----------------------------------------------------------------------------------
+    statedir = args.get('statedir')
+    if statedir:
+        code = artifact.sources(args['funcs'])
+        for name, p in plots.items():
+            p.state = State(join(statedir, name.replace('.json','') + '.state'),
+                            rebuild = args.get('cache') == 'refresh', funcs = code)
+
+    # Key figures by their inputs, so unchanged ones are not rendered again
+    #---------------------------------------------------------------------
+    files = dict(zip(names, filenames))
+    salt  = artifact.salt(args['funcs'], binds, compact = comp, export = exp)
+    for name, p in plots.items():
+        p.salt = salt
+        if args.get('force'):
+            artifact.forget(files[name])
+
+    def rendered(name : str, seconds : float) -> None:
+        if plots[name].key:
+            artifact.stamp(files[name], plots[name].key)
+        plots[name].profile.seconds['serialize'] = seconds
+        plots[name].profile.emit(plot = name)
+
+    # Draw plots, sharing pooled connections (and query results)
+    #------------------------------------------------------------
+    failed = {} # type: Dict[str,BaseException]
+    try:
+        batches = plan(zip(names, ps, filenames), db, binds, funcs, failed)
+        planned = sum(map(len, batches))
+        if planned > 1:
+            print('%d plots need %d queries (%d saved)'
+                  % (planned, len(batches), planned - len(batches)))
+
+        if args.get('aio'):
+            # Run every batch's query at once, then serialize
+            for name, fn, fig in agather(batches, db, binds, funcs, args.get('concurrency') or 8, exp):
+                try:
+                    if isinstance(fig, Exception):
+                        raise fig
+                    elif fig is not None:
+                        rendered(name, render(fig, fn, args['open'], comp))
+                except Exception as e:
+                    failed[name] = e
+        elif jobs > 1:
+            # Overlap queries (threads) with serialization (processes)
+            from multiprocessing    import get_context
+            from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor,as_completed
+            spawn = get_context('spawn')
+            with ThreadPoolExecutor(jobs) as threads, \
+                 ProcessPoolExecutor(jobs, mp_context = spawn) as procs:
+                htmls = {} # type: dict
+                futs  = [threads.submit(figures, b, db, binds, funcs, exp) for b in batches]
+                for fut in as_completed(futs):
+                    for name, fn, fig in fut.result():
+                        if isinstance(fig, Exception):
+                            failed[name] = fig
+                        elif fig is not None:
+                            htmls[procs.submit(render, fig, fn, args['open'], comp)] = name
+                for fut in as_completed(htmls):
+                    try:
+                        rendered(htmls[fut], fut.result())
+                    except Exception as e:
+                        failed[htmls[fut]] = e
+        else:
+            for b in batches:
+                for name, fn, fig in figures(b, db, binds, funcs, exp):
+                    try:
+                        if isinstance(fig, Exception):
+                            raise fig
+                        elif fig is not None:
+                            rendered(name, render(fig, fn, args['open'], comp))
+                    except Exception as e:
+                        failed[name] = e
+    finally:
+        db.close()
 
+    if len(ps)==1 and failed:
+        raise next(iter(failed.values()))
+    for name in sorted(failed):
+        print('Failed to draw %s: %r' % (name, failed[name]))
+    if failed:
+        raise SystemExit('%d of %d plots failed' % (len(failed), len(ps)))
 
 if __name__=='__main__':
     args = parser.parse_args()
@@ -1,8 +1,14 @@
 # External Modules
-from typing  import TypeVar,List,Callable as C,Optional as O,Any,Dict,Union as U, TextIO
+from typing  import TypeVar,List,Callable as C,Optional as O,Any,Dict,Union as U, TextIO, Tuple
 from inspect import getfullargspec,isfunction,getsourcefile,getmembers,isbuiltin
 from importlib.util import spec_from_file_location,module_from_spec
+from operator import itemgetter
+from numbers  import Number
+from os.path  import realpath,getmtime
+from threading import Lock
+from types    import CodeType
 import json
+import numpy as np # type: ignore
 '''
 Miscellaneous helper classes
 '''
@@ -39,7 +45,15 @@ def avg(x:list)->float:                 return sum(map(float,x))/len(x)
 def path_to_funcs(pth : str) -> Dict[str,C]:
     """
     Assumes we have files with one sole function in them
+
+    Each file is only executed once per process (unless it is modified).
     """
+    key = (realpath(pth), getmtime(pth))
+    if key not in registry.modules:
+        registry.modules[key] = _path_to_funcs(pth)
+    return dict(registry.modules[key])
+
+def _path_to_funcs(pth : str) -> Dict[str,C]:
     spec = spec_from_file_location('random',pth)
     if spec.loader is None:
         raise ValueError(pth)
@@ -54,6 +68,182 @@ def path_to_funcs(pth : str) -> Dict[str,C]:
     return dict(funcs)
 
 ################################################################################
+# Vectorized grouping
+#--------------------
+def factorize(keys : Any) -> Tuple[np.ndarray,np.ndarray]:
+    """
+    Integer codes for keys, numbered in order of first appearance, along with
+    the index at which each code first appears
+    """
+    arr = keys if isinstance(keys,np.ndarray) else column(list(keys))
+    if arr.dtype != object:
+        uniq, first, inv = np.unique(arr, return_index = True, return_inverse = True)
+        order = np.argsort(first, kind = 'stable')
+        rank  = np.empty(len(order), dtype = int)
+        rank[order] = np.arange(len(order))
+        return rank[inv.ravel()], first[order]
+
+    # hash-based for keys that cannot be sorted
+    seen  = {} # type: Dict[Any,int]
+    codes = np.empty(len(arr), dtype = int)
+    first = [] # type: List[int]
+    for i,k in enumerate(arr):
+        c = seen.get(k)
+        if c is None:
+            c = seen[k] = len(first)
+            first.append(i)
+        codes[i] = c
+    return codes, np.array(first, dtype = int)
+
+def split(codes : np.ndarray, vals : Any, n : int) -> List[list]:
+    '''The values for each of n codes (each in their original order)'''
+    order  = np.argsort(codes, kind = 'stable')
+    bounds = np.cumsum(np.bincount(codes, minlength = n))[:-1]
+    return [list(v) for v in np.split(column(list(vals))[order], bounds)]
+
+def partials(codes : np.ndarray,
+             n     : int,
+             vals  : Any = None,
+             parts : Any = None
+            ) -> Dict[str,np.ndarray]:
+    """
+    Partial aggregates (n, sum, sq, min, max) of the values with each of n
+    codes, ignoring missing values, or else of merging partial aggregates
+    (dicts with some of those keys, as computed by db.aggregate_query)
+
+    Partial minima and maxima which are not all numbers (e.g. dates or
+    strings) are merged as they are, into object arrays (None if missing)
+    """
+    if parts is None:
+        x  = np.asarray(vals, dtype = float)
+        ok = ~np.isnan(x)
+        p  = dict(n = ok.astype(float), sum = np.where(ok,x,0), sq = np.where(ok,x*x,0),
+                  min = np.where(ok,x,np.inf), max = np.where(ok,x,-np.inf))
+    else:
+        def field(k : str, missing : float) -> np.ndarray:
+            return np.array([missing if q.get(k) is None else float(q[k]) for q in parts])
+        p = dict(n = field('n',0), sum = field('sum',0), sq = field('sq',0))
+        for k, missing in (('min',np.inf),('max',-np.inf)):
+            ext  = [q.get(k) for q in parts]
+            p[k] = field(k, missing) if numeric(ext) else ext
+
+    out = {k:np.bincount(codes, weights = p[k], minlength = n) for k in ('n','sum','sq')}
+    for k, sign, ufunc, pick in (('min',1,np.minimum,min),('max',-1,np.maximum,max)):
+        if isinstance(p[k], list):
+            ext = np.full(n, None, dtype = object)
+            for c, v in zip(codes, p[k]):
+                if v is not None:
+                    ext[c] = v if ext[c] is None else pick(ext[c], v)
+            out[k] = ext
+        else:
+            out[k] = np.full(n, sign * np.inf)
+            ufunc.at(out[k], codes, p[k])
+    return out
+
+def aggregate(codes : np.ndarray,
+              n     : int,
+              agg   : str,
+              vals  : Any = None,
+              parts : Any = None
+             ) -> List[Any]:
+    """
+    Vectorized aggregation (avg, sum, count, min, max or stddev) of values
+    with each of n codes, or of partial aggregates (see `partials`). None
+    where undefined, e.g. the average of no values.
+
+    Values which are not all numbers (e.g. dates or strings) are aggregated
+    per code with `aggregate_values` instead.
+    """
+    if vals is not None and not numeric(vals):
+        return [aggregate_values(agg, v) for v in split(codes, vals, n)]
+    p   = partials(codes, n, vals, parts)
+    cnt = p['n']
+    tot = p['sum']
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        if agg == 'count':
+            out = cnt
+        elif agg == 'sum':
+            out = tot
+        elif agg == 'avg':
+            out = tot / cnt
+        elif agg == 'stddev':
+            sq  = p['sq']
+            out = np.sqrt(np.maximum(0, (sq - tot*tot/cnt) / (cnt - 1)))
+            out[cnt < 2] = np.nan
+        elif agg in ['min','max']:
+            out = p[agg]
+            if out.dtype == object: # not numbers
+                return list(out)
+            out[np.isinf(out)] = np.nan
+        else:
+            raise ValueError(agg)
+    return [None if np.isnan(v) else float(v) for v in out]
+
+def aggregate_values(agg : str, vals : list) -> Any:
+    """
+    Aggregation (see `aggregate`) of values which need not be numbers,
+    ignoring missing values: min and max compare the values themselves (e.g.
+    dates or strings), other aggregations convert them to floats
+    """
+    xs = [v for v in vals if v is not None]
+    if agg == 'count':
+        return float(len(xs))
+    elif not xs:
+        return None
+    elif agg in ['min','max']:
+        return (min if agg == 'min' else max)(xs)
+    return aggregate(np.zeros(len(xs), dtype = int), 1, agg, vals = [float(x) for x in xs])[0]
+
+def numeric(vals : Any) -> bool:
+    '''Whether values are all numbers (or missing), so can be aggregated as floats'''
+    arr = vals if isinstance(vals,np.ndarray) else column(list(vals))
+    if arr.dtype.kind in 'biuf':
+        return True
+    return arr.dtype == object and all(v is None or isinstance(v,Number) for v in arr)
+
+################################################################################
+class Registry(object):
+    """
+    Cache of functions given as strings (e.g. "lambda x: 1.1 * x + 2"), and of
+    the functions loaded from user files by path_to_funcs.
+
+    Strings are compiled once and evaluated in an explicit namespace: this
+    module's globals updated with the user functions. Results are cached on
+    the source text and the version of the namespace, i.e. the objects bound
+    to the names that the source refers to.
+    """
+    def __init__(self) -> None:
+        self.codes   = {} # type: Dict[str,CodeType]
+        self.funcs   = {} # type: Dict[tuple,C]
+        self.modules = {} # type: Dict[tuple,Dict[str,C]]
+        self.lock    = Lock()
+
+    @staticmethod
+    def _names(code : CodeType) -> List[str]:
+        '''Global names used by compiled code (including nested functions)'''
+        names = list(code.co_names)
+        for c in code.co_consts:
+            if isinstance(c,CodeType):
+                names.extend(Registry._names(c))
+        return names
+
+    def compile(self, src : str, funcs : Dict[str,C]) -> C:
+        code = self.codes.get(src)
+        if code is None:
+            code = self.codes[src] = compile(src, '<%s>' % src, 'eval')
+        ns      = globals()
+        version = tuple((n, id(funcs.get(n, ns.get(n)))) for n in self._names(code))
+        key     = (src, version)
+        f       = self.funcs.get(key)
+        if f is None:
+            f = eval(code, dict(ns, **funcs))
+            assert hasattr(f,'__call__'), type(f)
+            with self.lock:
+                self.funcs[key] = f
+        return f
+
+registry = Registry()
+
 def mkFunc(x : O[Fn], funcs : Dict[str,C]) -> C:
     """
     Take something (either a function or a string) and eval it if it's a string
@@ -64,10 +254,7 @@ def mkFunc(x : O[Fn], funcs : Dict[str,C]) -> C:
     elif isinstance(x,functype):
         return x
     elif isinstance(x,str):
-        locals().update(funcs)
-        f = eval(x)
-        assert hasattr(f,'__call__'), type(f)
-        return f
+        return registry.compile(x,funcs)
     else:
         raise ValueError
 
@@ -79,16 +266,57 @@ class FnArgs(object):
     By default:
         - the function will be the identity function (Expecting one argument)
         - the args will be the argument names defined in the function.
+
+    If `vectorize` (automatic for NumPy ufuncs), the function is assumed to
+    accept whole columns (arrays) at once - see apply_cols.
+
+    The number of calls of the function is counted; if given a Profile, the
+    time spent in it is recorded as the 'fnargs' stage.
     """
-    def __init__(self, func : U[str,C], args : U[str,List[str]], funcs : Dict[str,C]) -> None:
+    def __init__(self,
+                 func      : U[str,C],
+                 args      : U[str,List[str]],
+                 funcs     : Dict[str,C],
+                 vectorize : bool = False
+                ) -> None:
         if isinstance(func,str): func = mkFunc(func,funcs)
         if isinstance(args,str): args = args.split()
         self.func = func
         self.args = args
+        self.vectorize = vectorize or isinstance(func,np.ufunc)
+        self.calls     = 0
+        self.profile   = None # type: Any
 
     def apply(self,d : dict)->Any:
         args = [d[arg] for arg in self.args]
-        return self.func(*args)
+        self.calls += 1
+        if self.profile is None:
+            return self.func(*args)
+        with self.profile.stage('fnargs'):
+            return self.func(*args)
+
+    def apply_cols(self, cols : Dict[str,Any], n : int) -> np.ndarray:
+        """
+        Evaluate over columns of length n: one call on the whole arrays if
+        vectorized, otherwise one call per row. If the vectorized call raises
+        any error (or does not give one value per row), fall back to per-row
+        calls from now on, so errors of the function itself still surface.
+        """
+        args = [cols[arg] for arg in self.args]
+        if self.vectorize and args:
+            try:
+                self.calls += 1
+                out = np.asarray(self.func(*args))
+                if out.shape == (n,):
+                    return out
+            except Exception:
+                pass
+            self.vectorize = False
+
+        self.calls += n
+        if args:
+            return column([self.func(*row) for row in zip(*args)])
+        return column([self.func() for _ in range(n)])
 
     def __call__(self, d : dict) -> Any:
         return self.apply(d)
@@ -126,6 +354,133 @@ class Group(object):
     def add_elem(self,x:Any)->None:
         self.elems.append(x)
 
-    def sort(self,key:C=str)->'Group':
+    def sort(self,key:U[str,C]=str)->'Group':
+        '''Sort elements, either with a key function or by the named key'''
+        if isinstance(key,str): key = itemgetter(key)
         self.elems = sorted(self.elems,key=key)
         return self
+
+    def take(self,inds:List[int])->'Group':
+        '''Keep only the elements at these indices (in this order)'''
+        self.elems = [self.elems[i] for i in inds]
+        return self
+
+    def extend(self,other:'Group')->'Group':
+        '''Append the elements of another group'''
+        self.elems.extend(other.elems)
+        return self
+
+def column(vals:list)->np.ndarray:
+    """
+    Pack a list of values into a 1D array: of objects unless they are numbers
+    (a fixed width string array would take the width of the longest string
+    for every element)
+    """
+    arr = np.asarray(vals)
+    if arr.ndim != 1 or arr.dtype.kind in 'USV':
+        arr = np.empty(len(vals),dtype=object)
+        arr[:] = vals
+    return arr
+
+class ColumnGroup(Group):
+    """
+    Columnar Group: elements are stored as one array per key rather than as a
+    list of dicts, and g[key] returns that array without copying.
+
+    Elements added with add_elem are buffered and packed into arrays by `pack`
+    (or on the next column access). `elems` still gives a list of dicts, for
+    code that needs rows.
+    """
+    def __init__(self, id : int, label : str, rep : Any, elems : List = []) -> None:
+        self.id = id; self.label = label; self.rep = rep
+        self.cols  = {} # type: Dict[str,np.ndarray]
+        self.buf   = {} # type: Dict[str,list]
+        self.parts = [] # type: List[Dict[str,np.ndarray]] ### packed, not yet concatenated
+        self.elems = elems
+
+    def __str__(self)->str:
+        s = 's' if len(self)!=1 else ''
+        return self.label+' (%d element%s)'%(len(self),s)
+
+    def __len__(self)->int:
+        cols = self.columns
+        return len(next(iter(cols.values()))) if cols else 0
+
+    def __getitem__(self,key:str)->np.ndarray:
+        return self.columns[key]
+
+    @property
+    def columns(self)->Dict[str,np.ndarray]:
+        '''Mapping of keys to column arrays, packing any buffered elements'''
+        self.pack()
+        if self.parts:
+            chunks = ([self.cols] if self.cols else []) + self.parts
+            self.cols  = {k:np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+            self.parts = []
+        return self.cols
+
+    @columns.setter
+    def columns(self,cols:Dict[str,Any])->None:
+        self.cols  = {k:np.asarray(v) for k,v in cols.items()}
+        self.buf   = {}
+        self.parts = []
+
+    def pack(self)->None:
+        '''Pack buffered elements into arrays (concatenated on the next column access)'''
+        if self.buf:
+            self.parts.append({k:column(v) for k,v in self.buf.items()})
+            self.buf = {}
+
+    @property
+    def elems(self)->List[dict]: # type: ignore
+        cols = self.columns
+        keys = list(cols)
+        return [dict(zip(keys,row)) for row in zip(*[cols[k] for k in keys])]
+
+    @elems.setter
+    def elems(self,elems:List[dict])->None:
+        self.cols, self.buf, self.parts = {}, {}, []
+        for e in elems:
+            self.add_elem(e)
+
+    def add_elem(self,x:dict)->None:
+        if not self.buf:
+            keys = self.cols or (self.parts[0] if self.parts else x)
+            self.buf = {k:[] for k in keys}
+        for k,v in self.buf.items():
+            v.append(x[k])
+
+    def apply(self,f:C)->'ColumnGroup':
+        """modify the columns with a function (Dict[str,array] -> Dict[str,array])"""
+        self.columns = f(self.columns)
+        return self
+
+    def map(self,f:C)->'ColumnGroup':
+        """modify elements individually by mapping a function"""
+        self.elems = [f(e) for e in self.elems]
+        return self
+
+    def sort(self,key:U[str,C]=str)->'ColumnGroup':
+        '''Sort elements: a stable argsort if key names a column'''
+        if isinstance(key,str):
+            return self.take(np.argsort(self[key],kind='stable'))
+        elems = self.elems
+        inds  = sorted(range(len(elems)),key=lambda i: key(elems[i]))
+        return self.take(inds)
+
+    def take(self,inds:Any)->'ColumnGroup':
+        '''Keep only the elements at these indices (in this order)'''
+        self.cols = {k:v[inds] for k,v in self.columns.items()}
+        return self
+
+    def extend(self,other:Group)->'ColumnGroup':
+        '''Append the elements of another group'''
+        if not len(other):
+            return self
+        elif not len(self):
+            self.elems = other.elems
+            return self
+        new = other.columns if isinstance(other,ColumnGroup) else \
+              {k:column([e[k] for e in other.elems]) for k in self.columns}
+        self.cols = {k:np.concatenate([v,new[k]]) for k,v in self.columns.items()}
+        return self
@@ -0,0 +1,70 @@
+# External Modules
+from typing   import Any,Dict,Optional as O
+from base64   import b64encode
+from warnings import warn
+import numpy as np # type: ignore
+'''
+Compact HTML output of figures
+
+Numeric trace data is written as base64 encoded typed arrays (which plotly.js
+decodes directly, rather than parsing JSON numbers) and plotly.js itself is
+written once per output directory, rather than inlined in every HTML file.
+'''
+################################################################################
+
+# NumPy dtypes -> plotly.js typed array codes
+dtypes = {'float64':'f8','float32':'f4','int32':'i4','uint32':'u4',
+          'int16':'i2','uint16':'u2','int8':'i1','uint8':'u1'} # type: Dict[str,str]
+
+def supported() -> bool:
+    '''Whether the bundled plotly.js can decode typed arrays (v2.28+)'''
+    from plotly.offline import get_plotlyjs_version # type: ignore
+    version = tuple(int(v) for v in get_plotlyjs_version().split('.')[:2])
+    return version >= (2, 28)
+
+def typed(x : Any) -> O[dict]:
+    '''Typed array spec for a numeric array (or list), else None'''
+    if isinstance(x, (list, tuple)):
+        if len(x) < 2 or not all(isinstance(v,(int,float)) and not isinstance(v,bool) for v in x):
+            return None
+        x = np.asarray(x)
+    elif not isinstance(x, np.ndarray) or x.ndim != 1:
+        return None
+
+    if x.dtype.kind in 'iu' and x.dtype.name not in dtypes:
+        info = np.iinfo(np.int32)
+        ok   = not len(x) or (x.min() >= info.min and x.max() <= info.max)
+        x    = x.astype(np.int32 if ok else np.float64)
+    elif x.dtype.kind == 'f' and x.dtype.name not in dtypes:
+        x = x.astype(np.float64)
+    if x.dtype.name not in dtypes:
+        return None
+    arr = np.ascontiguousarray(x, dtype = x.dtype.newbyteorder('<'))
+    return dict(dtype = dtypes[x.dtype.name], bdata = b64encode(arr.tobytes()).decode())
+
+def _encode(x : Any) -> Any:
+    if isinstance(x, dict):
+        return x if 'bdata' in x else {k:_encode(v) for k,v in x.items()}
+    spec = typed(x)
+    if spec is not None:
+        return spec
+    elif isinstance(x, np.ndarray):
+        return x.tolist()
+    return x
+
+def encode(fig : dict) -> dict:
+    '''Replace numeric arrays in a figure's traces with typed arrays'''
+    return dict(fig, data = [_encode(trace) for trace in fig.get('data', [])])
+
+def write_html(fig : dict, filename : str, auto_open : bool = False) -> None:
+    """
+    Write a figure (dict) to HTML using typed arrays, loading plotly.js from
+    plotly.min.js in the same directory (written there if missing)
+    """
+    from plotly.io import write_html as write # type: ignore
+    if supported():
+        fig = encode(fig)
+    else:
+        warn('plotly.js is too old to decode typed arrays: writing plain JSON')
+    write(fig, filename, include_plotlyjs = 'directory', include_mathjax = 'cdn',
+          auto_open = auto_open, validate = False)
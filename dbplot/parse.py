@@ -1,10 +1,18 @@
 # External Modules
 from typing         import Any
 from argparse       import ArgumentParser,Action
-from distutils.util import strtobool
 
 ##########################################################################################
 
+def strtobool(val:str)->int:
+    '''1 or 0 for a string like 'yes'/'no' (distutils is slow to import and deprecated)'''
+    val = val.lower()
+    if val in ('y','yes','t','true','on','1'):
+        return 1
+    elif val in ('n','no','f','false','off','0'):
+        return 0
+    raise ValueError('invalid truth value %r' % (val,))
+
 class StoreDictKeyPair(Action):
     """
     Usage:
@@ -65,6 +73,70 @@ parser.add_argument('--outpth',
                     type    = str,
                     help    = 'output file name for plot')
 
+parser.add_argument('--jobs',
+                    default = 1,
+                    type    = int,
+                    help    = 'Number of plots to query for and render concurrently')
+
+parser.add_argument('--aio',
+                    default = False,
+                    type    = strtobool,
+                    help    = 'Run all plots\' queries concurrently with asyncio '\
+                              '(requires psycopg 3 and psycopg_pool)')
+
+parser.add_argument('--concurrency',
+                    default = 8,
+                    type    = int,
+                    help    = 'Maximum number of queries in flight with --aio')
+
+parser.add_argument('--compact',
+                    default = False,
+                    type    = strtobool,
+                    help    = 'Write numeric data as binary typed arrays and share one '\
+                              'plotly.js file per output directory')
+
+parser.add_argument('--export',
+                    default = '',
+                    choices = ['','csv','parquet','arrow'],
+                    help    = 'Also write the data drawn in each plot to a file of this '\
+                              'format next to its HTML (parquet and arrow need pyarrow)')
+
+parser.add_argument('--force',
+                    default = False,
+                    type    = strtobool,
+                    help    = 'Render every plot, even those whose spec, functions, binds '\
+                              'and query results are unchanged since last written')
+
+parser.add_argument('--profile',
+                    nargs   = '?',
+                    const   = '-',
+                    default = '',
+                    type    = str,
+                    help    = 'Print a breakdown of time per stage for each plot, or '\
+                              'append it as JSON to the given file')
+
+parser.add_argument('--cache',
+                    default = 'use',
+                    choices = ['use','refresh','off'],
+                    help    = 'Reuse cached query results, refresh them or bypass the cache')
+
+parser.add_argument('--cachedir',
+                    default = '',
+                    type    = str,
+                    help    = 'Directory to persist cached query results in (default: memory only)')
+
+parser.add_argument('--cachettl',
+                    default = 3600.,
+                    type    = float,
+                    help    = 'Seconds for which query results persisted in --cachedir are reused')
+
+parser.add_argument('--statedir',
+                    default = '',
+                    type    = str,
+                    help    = 'Directory to save the groups of plots with a watermark '\
+                              'column, so later runs only query newer rows '\
+                              '(--cache refresh rebuilds them)')
+
 parser.add_argument("--args",
                     action  = StoreDictKeyPair,
                     nargs   = "+",
@@ -1,16 +1,30 @@
 # External Modules
-from typing      import (Type,Any,Tuple,List,Dict,TypeVar,Set,
+from typing      import (Type,Any,Tuple,List,Dict,TypeVar,Set,Iterable,Iterator,TYPE_CHECKING,
                          Optional as O, Callable as C, Union as U)
 from abc         import abstractmethod
 from operator    import itemgetter
+from bisect      import bisect_right
+from numbers     import Number
 from collections import OrderedDict
+from asyncio     import get_running_loop
+from warnings    import warn
 
-from plotly.graph_objs import Figure,Layout # type: ignore
+import numpy as np # type: ignore
+
+if TYPE_CHECKING:
+    from plotly.graph_objs import Figure # type: ignore
 
 # Internal Modules
-from dbplot.db     import ConnectInfo as Conn,select_dict
-from dbplot.misc   import FnArgs,Group,mapfst,mapsnd,avg,const,identity,joiner,mkFunc, load
+from dbplot.db     import (ConnectInfo as Conn,Sources,select_dict,select_iter,aselect_dict,
+                           select_columns,estimate,aggs,aggregate_query,range_query,
+                           bin_query,watermark_query,sample_query,columns,coltypes,decodable,
+                           cached)
+from dbplot.misc   import (FnArgs,Group,ColumnGroup,column,factorize,split,aggregate,partials,
+                           mapfst,mapsnd,avg,const,identity,joiner,mkFunc, load)
 from dbplot.style  import mkStyle
+from dbplot.profile import Profile
+from dbplot.decimate import decimate
+from dbplot.incremental import State,fingerprint,later
 #############################################################################
 
 
@@ -27,7 +41,13 @@ class Plot(object):
         err = 'Unsupported keys: %s'
         bad = set(kwargs) - self.kw
         assert not bad, err % bad
-        self.data = kwargs
+        self.data    = kwargs
+        self.spec    = dict(kwargs) # as given, before defaults are filled in
+        self.profile = Profile() # replace with a Profile that has sinks to instrument
+        self.state   = None # type: O[State] ### set to refresh incrementally
+        self.salt    = None # type: O[str] ### set to key the figure (see artifact.py)
+        self.key     = None # type: O[str]
+        self.streamed = False # whether the last query's results must be streamed (see _preflight)
 
     def __str__(self)->str:
         return str(self.data)
@@ -47,21 +67,123 @@ class Plot(object):
     # 'Exposed API' #
     #---------------#
 
-    def fig(self, conn : Conn, binds : list, funcs : dict) -> Figure:
-        '''Make a plotly figure'''
-        self._groups(conn,binds,funcs)
-        return Figure(data=self._data(),layout=self._layout())
+    def fig(self,
+            conn    : Conn,
+            binds   : list,
+            funcs   : dict,
+            results : O[Iterable[dict]] = None
+           ) -> 'Figure':
+        '''
+        Make a plotly figure. `results` may be given if they have already been
+        fetched (i.e. the results of running the SQL returned by `query`)
+        '''
+        if results is None:
+            self._groups(conn,binds,funcs)
+        else:
+            self._groups_from(results)
+        with self.profile.stage('draw'):
+            data = self._data()
+        with self.profile.stage('layout'):
+            layout = self._layout()
+
+        calls = sum(f.calls for f in vars(self).values() if isinstance(f,FnArgs))
+        self.profile.count('fncalls', calls)
+        from plotly.graph_objs import Figure # type: ignore
+        return Figure(data=data,layout=layout)
+
+    def query(self, conn : Conn, binds : list, funcs : dict) -> str:
+        '''Prepare the plot for drawing and return the SQL it needs executed'''
+        with self.profile.stage('query'):
+            self._init(funcs)
+            assert self['query']
+            self.streamed = False
+            self.base = conn.tag(self['query']) if isinstance(conn, Sources) else self['query']
+            self.sql  = self._query(conn, binds)
+            self.seed = None # type: O[dict]
+            self.by   = conn.column if isinstance(conn, Sources) else '' ### watermarks per source
+            if self._incremental:
+                if isinstance(conn, Sources) and not self.by:
+                    raise ValueError('Incremental refresh of several sources needs a source '
+                                     'column, to keep a watermark per source')
+                cols          = columns(conn, self.sql, binds)
+                self.statekey = fingerprint(self.spec, binds, conn, cols,
+                                            self.state.funcs) # type: ignore
+                self.seed     = self.state.load(self.statekey) # type: ignore
+                if self.seed and self.seed['watermark'] is not None:
+                    if self.by:
+                        self.sql = conn.since(self.sql, self['watermark'],  # type: ignore
+                                              self.seed['watermark'])
+                    else:
+                        self.sql = watermark_query(self.sql, self['watermark'],
+                                                   self.seed['watermark'])
+            self._preflight(conn, binds)
+            self.bulk = self._bulk(conn, binds)
+        return self.sql
+
+    def fetch(self, conn : Conn, binds : list) -> Iterable[dict]:
+        '''Execute the SQL returned by `query` (streaming results if requested)'''
+        if self._itersize:
+            rows = select_iter(conn, self.sql, binds, self._itersize)
+            if self.profile.enabled:
+                return self.profile.iterate(rows, 'fetch', 'rows')
+            return rows
+        if self.bulk:
+            with self.profile.stage('fetch'):
+                cols = select_columns(conn, self.sql, binds)
+            self.profile.count('rows', len(next(iter(cols.values()), [])))
+            return cols # type: ignore
+        with self.profile.stage('fetch'):
+            rows = select_dict(conn, self.sql, binds)
+        self.profile.count('rows', len(rows))
+        return rows
+
+    async def afig(self, conn : Conn, binds : list, funcs : dict) -> 'Figure':
+        '''
+        Async `fig`: the plot's query runs on the async connection pool. Any
+        (small) queries needed to prepare it, such as a histogram's range, use
+        the blocking pool in a thread, as do plots which stream their results
+        (if requested, or if their results are too large to fetch at once).
+        '''
+        loop = get_running_loop()
+        await loop.run_in_executor(None, self.query, conn, binds, funcs)
+        if self._itersize:
+            return await loop.run_in_executor(
+                None, lambda: self.fig(conn, binds, funcs, results = self.fetch(conn, binds)))
+        rows = await self.afetch(conn, binds)
+        return self.fig(conn, binds, funcs, results = rows)
+
+    async def afetch(self, conn : Conn, binds : list) -> List[dict]:
+        '''Async `fetch` (of the full result: not for streamed plots)'''
+        assert not self._itersize, 'Streamed results cannot be fetched asynchronously'
+        with self.profile.stage('fetch'):
+            rows = await aselect_dict(conn, self.sql, binds)
+        self.profile.count('rows', len(rows))
+        return rows
+
+    def tables(self) -> Iterator[Tuple[str,Dict[str,Any]]]:
+        '''(label, columns) of the data drawn for each group, once `fig` has run'''
+        assert hasattr(self,'traces'), 'Draw the figure before exporting its data'
+        for g, trace in zip(self.groups, self.traces):
+            yield g.label, self._table(g, trace)
+
+    def export(self, pth : str) -> None:
+        '''Write the data drawn (see `tables`) to a CSV, Parquet or Arrow file'''
+        from dbplot.export import write
+        with self.profile.stage('export'):
+            write(self.tables(), pth, self.tablecols)
 
-    @abstractmethod
     def csv(self, pth : str) -> None:
         '''Write plot data to a csv'''
-        raise NotImplementedError
+        from dbplot.export import write_csv
+        with self.profile.stage('export'):
+            write_csv(self.tables(), pth, self.tablecols)
     #------------------#
     # Abstract methods #
     #------------------#
 
     @abstractmethod
     def _layout(self) -> dict:
+        from plotly.graph_objs import Layout # type: ignore
         frame = self['frame'] and self['frame'].lower()[0]=='t'
         square = self['square'] and self['square'].lower()[0]=='t'
         titlefont = dict(family='Times New Roman', size=60)
@@ -85,8 +207,6 @@ class Plot(object):
 
         assert 'xcols' in self and 'query' in self
 
-        locals().update(funcs)
-
         # X func, handle defaults
         if not 'xfunc' in self:
             if isinstance(self['xcols'],str):
@@ -96,7 +216,8 @@ class Plot(object):
             assert len(xcols) == 1
             self['xfunc'] = identity
 
-        self.xFunc = FnArgs(func = self['xfunc'], args = self['xcols'], funcs = funcs)
+        self.xFunc = FnArgs(func = self['xfunc'], args = self['xcols'], funcs = funcs,
+                            vectorize = self._flag('vectorize'))
 
         # Labeling of data points, handle defaults (meaningless for HIST)
         if 'lcols' not in self:
@@ -137,15 +258,35 @@ class Plot(object):
     @abstractmethod
     def _process_group_dict(self,d:Dict)->Any:
         """
-        Take a DB output dict and make a pair: <SOMETHING>,(group ID, group label)
+        Take a DB output dict and keep only what is needed to draw it
+        (applied to each row as it is sorted into its group)
         """
         return d
 
+    def _process_group_cols(self, cols : Dict[str,Any], n : int) -> Dict[str,Any]:
+        """
+        Columnar equivalent of _process_group_dict, applied to a whole
+        ColumnGroup of raw DB outputs (with n elements) when vectorizing
+        """
+        keys = list(cols)
+        rows = [self._process_group_dict(dict(zip(keys,r)))
+                for r in zip(*[cols[k] for k in keys])]
+        return {k:column([r[k] for r in rows]) for k in (rows[0] if rows else [])}
+
+    def _compact(self, g : Group) -> None:
+        """
+        Shrink the elements of a group while its rows are streamed in (called
+        after every chunk of rows it was given): by default, pack them into
+        arrays. Subclasses may instead reduce them to what they draw.
+        """
+        if isinstance(g, ColumnGroup):
+            g.pack()
+
     @property
     @abstractmethod
     def kw(self) -> Set[str]:
         '''List of valid keyword arguments'''
-        return {'query','title','xlab','frame','square',
+        return {'query','title','xlab','frame','square','stream','columnar','vectorize','watermark','copy','overlimit',
                 'xcols','xfunc','lcols','lfunc','gcols','gfunc'}
 
     #------------------------#
@@ -158,25 +299,43 @@ class Plot(object):
         return d
 
     @staticmethod
-    def _make_groups(inputs : List[Dict[str,Any]],
-                     gFunc  : FnArgs,
-                     glFunc : FnArgs
+    def _make_groups(inputs  : Iterable[Dict[str,Any]],
+                     gFunc   : FnArgs,
+                     glFunc  : FnArgs,
+                     process : C = identity,
+                     group   : Type[Group] = Group,
+                     compact : O[C] = None,
+                     every   : int = 0
                     ) -> List[Group]:
         """
-        Take a list of processed DB outputs and sort into groups
+        Take an iterable of DB outputs and sort into groups, storing each
+        output after transforming it with `process`. Inputs are consumed one at
+        a time, so they may be streamed from the DB.
+
+        `group` is the container class (ColumnGroup stores columnar arrays)
+
+        If given, `compact` is applied to each group given new outputs after
+        every `every` of them (see Plot._compact)
 
         The groups will become different lines/bars on the final plot
         """
         groups = {} # type: Dict[Any,Group]
         counter = 0
-        for x in inputs:
+        touched = set() # type: Set[Any]
+        for i, x in enumerate(inputs, 1):
             g = gFunc(x)
             if g in groups:
-                groups[g].add_elem(x)
+                groups[g].add_elem(process(x))
             else:
                 gl = glFunc(x)
-                groups[g] = Group(id=counter,label=gl,rep=g,elems=[x])
+                groups[g] = group(id=counter,label=gl,rep=g,elems=[process(x)])
                 counter+=1
+            if compact is not None:
+                touched.add(g)
+                if i % every == 0:
+                    for t in touched:
+                        compact(groups[t])
+                    touched = set()
 
         return list(groups.values())
 
@@ -199,10 +358,43 @@ class Plot(object):
     # Properties #
     #------------#
 
+    @property
+    def typ(self) -> str:
+        '''Name of the type of plot, as given by the 'type' key of spec files'''
+        return next(k for k,v in self.pltdict().items() if v is type(self))
+
     @property
     def _has_leg(self)->bool:
         return bool(self['gcols'])
 
+    @property
+    def _groupcls(self)->Type[Group]:
+        '''Store group elements as columnar arrays if requested'''
+        columnar = self._flag('columnar') or self._flag('vectorize') or self._itersize
+        return ColumnGroup if columnar else Group
+
+    def _cols(self, key : str) -> List[str]:
+        '''Column names given by a key, either a list or space separated'''
+        cols = self[key] or []
+        return cols.split() if isinstance(cols,str) else list(cols)
+
+    def _flag(self, key : str) -> bool:
+        '''Interpret a boolean plot key, which may be given as a string'''
+        val = self[key]
+        if isinstance(val,str):
+            return val.lower()[:1]=='t'
+        return bool(val)
+
+    @property
+    def _itersize(self)->int:
+        '''Rows per round trip when streaming query results (0 = no streaming)'''
+        stream = self['stream']
+        if isinstance(stream,str):
+            stream = 2000 if stream.lower()[0]=='t' else 0
+        elif stream is True:
+            stream = 2000
+        return int(stream or 0) or (2000 if self.streamed else 0)
+
     @property
     def opacity(self) -> float:
         return max(0.1,1-len(self.groups)/10)
@@ -214,21 +406,229 @@ class Plot(object):
         """
         Populates: self.groups
         """
-        self._init(funcs)
-        assert self['query']
-        results = conn.select_dict(self['query'], binds)
-        self.groups = self._make_groups(results, self.gFunc, self.glFunc)
+        self.query(conn, binds, funcs)
+        self._groups_from(self.fetch(conn, binds))
+
+    def _groups_from(self, results : Iterable[dict]) -> None:
+        """
+        Populates self.groups from query results, which are only read (so
+        they may be shared between plots). Results may be rows or, if fetched
+        with COPY, a dict of column arrays.
+        """
+        prof = self.profile
+        if prof.enabled:
+            for f in vars(self).values():
+                if isinstance(f,FnArgs):
+                    f.profile = prof
+        if isinstance(results, dict):
+            if not self._incremental:
+                return self._groups_from_cols(results)
+            keys    = list(results)
+            results = (dict(zip(keys,r)) for r in zip(*results.values()))
+        if self._incremental:
+            results = self._watch(results)
+        every   = self._itersize # streamed rows are compacted chunk by chunk
+        compact = self._compact if every else None
+
+        if self._flag('vectorize'):
+            # group the raw outputs, then process each group column-wise
+            with prof.stage('group'):
+                self.groups = self._make_groups(results, self.gFunc, self.glFunc,
+                                                group = ColumnGroup, compact = compact,
+                                                every = every)
+            with prof.stage('fnargs'):
+                for g in self.groups:
+                    n = len(g)
+                    g.apply(lambda cols: self._process_group_cols(cols,n))
+        else:
+            with prof.stage('group'):
+                self.groups = self._make_groups(results, self.gFunc, self.glFunc,
+                                                self._process_group_dict, self._groupcls,
+                                                compact, every)
+
+        if self._incremental:
+            self._merge_seed()
+        prof.groups = [[str(g.label), len(g)] for g in self.groups]
+
+    def _groups_from_cols(self, cols : Dict[str,Any]) -> None:
+        '''Populates self.groups (of ColumnGroups) from columnar query results'''
+        prof = self.profile
+        n    = len(next(iter(cols.values()), []))
+        with prof.stage('group'):
+            if self.gFunc.args:
+                keys = self.gFunc.apply_cols(cols, n)
+            else:
+                keys = column([self.gFunc.func()] * n)
+            codes, firsts = factorize(keys)
+            order  = np.argsort(codes, kind = 'stable')
+            bounds = np.cumsum(np.bincount(codes, minlength = len(firsts)))[:-1]
+            self.groups = []
+            for i, inds in enumerate(np.split(order, bounds) if n else []):
+                first = {k:v[firsts[i]] for k,v in cols.items()}
+                rep   = keys[firsts[i]]
+                g     = ColumnGroup(id = i, label = self.glFunc(first),
+                                    rep = rep.item() if isinstance(rep,np.generic) else rep)
+                g.columns = {k:v[inds] for k,v in cols.items()}
+                self.groups.append(g)
+        with prof.stage('fnargs'):
+            for g in self.groups:
+                m = len(g)
+                g.apply(lambda c: self._process_group_cols(c,m))
+        prof.groups = [[str(g.label), len(g)] for g in self.groups]
+
+    def _bulk(self, conn : Conn, binds : list) -> bool:
+        """
+        Whether to fetch with COPY: if requested, else if many rows are
+        estimated and every column is fetched as it would be as rows (results
+        already cached are fetched as they were, without asking the DB)
+        """
+        if self._itersize or self._incremental:
+            return False
+        elif self['copy'] is not None:
+            return self._flag('copy')
+        elif cached(conn, self.sql, binds, copy = True):
+            return True
+        elif not conn.copyrows or cached(conn, self.sql, binds):
+            return False
+        rows = self.est[0] if self.est else estimate(conn, self.sql, binds)[0]
+        return rows > conn.copyrows and decodable(coltypes(conn, self.sql, binds))
+
+    def _preflight(self, conn : Conn, binds : list) -> None:
+        """
+        Check the planner's estimate of the query's result against the limits
+        of the connection (maxrows, maxbytes). If over, act according to the
+        'overlimit' key:
+            - 'auto' (default): rewrite the query to aggregate or bin in the DB
+                                (if the plot allows), else sample its rows
+            - 'sample': keep a random fraction of the rows within the limits
+            - 'stream': stream the results (bounding the memory of fetching)
+            - 'fail': refuse to run the query
+
+        Rows are sampled from the user's query, before any rewrite. Results
+        which are already aggregated or binned in the DB cannot be reduced by
+        sampling, so are streamed if 'auto' (or else refused).
+
+        Queries whose results are already cached are not checked.
+        """
+        self.est = None # type: O[Tuple[float,int]]
+        if not (conn.maxrows or conn.maxbytes):
+            return
+        elif cached(conn, self.sql, binds) or cached(conn, self.sql, binds, copy = True):
+            return
+        how = (self['overlimit'] or 'auto').lower()
+        assert how in ('auto','sample','stream','fail'), 'Unknown overlimit: '+how
+        with self.profile.stage('preflight'):
+            self.est = estimate(conn, self.sql, binds)
+            frac     = self._within(conn)
+            if frac >= 1:
+                return
+            elif how == 'auto' and self._cheaper():
+                self.sql = self._query(conn, binds)
+                self.est = estimate(conn, self.sql, binds)
+                frac     = self._within(conn)
+                if frac >= 1:
+                    return
+            rewritten = self.sql != self.base
+            if how in ('auto','sample') and not self._incremental and not rewritten:
+                warn('Sampling %.2g%% of the rows of %s' % (100 * frac, self['title'] or 'a plot'))
+                self.base = sample_query(self.base, frac)
+                self.sql  = self._query(conn, binds)
+                self.est  = (self.est[0] * frac, self.est[1])
+            elif how == 'stream' or (how == 'auto' and rewritten):
+                self.streamed = True
+            else:
+                rows, width = self.est
+                raise ValueError('Query estimated to return %d rows of %d bytes, over the '
+                                 'limits (maxrows = %d, maxbytes = %d): add a LIMIT, or set '
+                                 'overlimit to sample or stream\n%s'
+                                 % (rows, width, conn.maxrows, conn.maxbytes, self.sql))
+
+    def _within(self, conn : Conn) -> float:
+        '''Fraction of the estimated result within the limits (>= 1 if all of it)'''
+        assert self.est is not None
+        rows, width = self.est
+        fracs = [float('inf')]
+        if conn.maxrows:
+            fracs.append(conn.maxrows / max(rows, 1.))
+        if conn.maxbytes:
+            fracs.append(conn.maxbytes / max(rows * width, 1.))
+        return min(fracs)
+
+    def _cheaper(self) -> bool:
+        '''Switch to a cheaper rewrite of the query, if possible (and not already)'''
+        return False
+
+    @property
+    def _incremental(self) -> bool:
+        '''Whether to only fetch rows past the watermark of the last refresh'''
+        return bool(self['watermark']) and self.state is not None
+
+    def _watch(self, results : Iterable[dict]) -> Iterable[dict]:
+        """
+        Pass through results, keeping track of the greatest watermark (of each
+        source, in a dict, if the rows come from several)
+        """
+        wm, by = self['watermark'], self.by
+        if not by:
+            self.mark = None
+            for r in results:
+                self.mark = later(self.mark, r[wm])
+                yield r
+            return
+        self.mark = {}
+        for r in results:
+            self.mark[r[by]] = later(self.mark.get(r[by]), r[wm])
+            yield r
+
+    def _merge_seed(self) -> None:
+        '''Merge new groups into those saved by the last refresh, then save them'''
+        assert self.state is not None
+        mark = self.mark
+        if self.seed:
+            groups = OrderedDict((g.rep,g) for g in self.seed['groups'])
+            for g in self.groups:
+                if g.rep in groups:
+                    groups[g.rep].extend(g)
+                else:
+                    g.id = len(groups)
+                    groups[g.rep] = g
+            self.groups = list(groups.values())
+            old  = self.seed['watermark']
+            if self.by:
+                mark = {k:later(old.get(k), mark.get(k)) for k in list(old) + list(mark)}
+            else:
+                mark = later(old, mark)
+        self.mark = mark
+        self.state.save(self.statekey, mark, self.groups)
+
+    def _query(self, conn : Conn, binds : list) -> str:
+        '''The SQL actually executed (subclasses may rewrite the user's query)'''
+        return self.base
 
     def _data(self) -> list:
         ''' This seems to be a general enough implementation'''
-        # for g in self.groups:
+        self.traces = [self._draw(g) for g in self.groups]
+        return self.traces
 
-        return [self._draw(g.map(self._process_group_dict)) for g in self.groups]
+    tablecols = [] # type: List[str] ### names of the columns given by _table
+
+    def _table(self, g : Group, trace : dict) -> Dict[str,Any]:
+        '''Columns of the data drawn for a group, given its trace'''
+        raise NotImplementedError
 
 ################################################################################
 class LinePlot(Plot):
     """
-    Scatter or line plot - a relation between two numeric variables
+    Scatter or line plot - a relation between two numeric variables. Extra
+    keywords are:
+        - maxpoints :: int (draw at most ~this many points per line)
+        - decimate  :: 'lttb' (default), 'minmax' or 'stride' (how to choose
+                       the points drawn when a line has more than maxpoints)
+        - webgl     :: int (draw lines with at least this many points using WebGL)
+        - post      :: a function, or list of functions applied in turn, to
+                       the columns (a dict of arrays x, y and l, sorted by x)
+                       of each line before drawing, e.g. those of
+                       scripts/misc_funcs_np.py
     """
     def _init(self, funcs : Dict[str,C])->None:
         super()._init(funcs)
@@ -244,20 +644,28 @@ class LinePlot(Plot):
             assert len(ycols) == 1
             self['yfunc'] = identity
 
-        self.yFunc = FnArgs(func = self['yfunc'], args = self['ycols'], funcs = funcs)
-
-    def csv(self, pth : str) -> None:
-        '''Write plot data to a csv'''
-        raise NotImplementedError
+        self.yFunc = FnArgs(func = self['yfunc'], args = self['ycols'], funcs = funcs,
+                            vectorize = self._flag('vectorize'))
+        post       = self['post'] or []
+        self.posts = [mkFunc(f, funcs) for f in (post if isinstance(post,list) else [post])]
 
     @property
     def kw(self)->Set[str]:
-        return super().kw | {'ylab','ycols','yfunc','scatter'}
+        return super().kw | {'ylab','ycols','yfunc','scatter',
+                             'maxpoints','decimate','webgl','post'}
 
     def _draw(self, g : Group) -> dict:
         """process query results, then draw the lines"""
-        # do aggregations, postprocessing to modify 'g', eventually
-        g.sort(key=lambda x: x['x'])
+        g.sort(key='x')
+        if self.posts:
+            cols = g.columns if isinstance(g,ColumnGroup) else {k:column(g[k]) for k in 'xyl'}
+            for f in self.posts:
+                cols = f(cols)
+            g = ColumnGroup(id = g.id, label = g.label, rep = g.rep)
+            g.columns = cols
+        maxpoints = int(self['maxpoints'] or 0)
+        if maxpoints and len(g) > maxpoints:
+            g.take(decimate(g['x'], g['y'], maxpoints, self['decimate'] or 'lttb'))
         return self._add_line(g)
 
     def _process_group_dict(self, d : dict) -> dict:
@@ -270,6 +678,11 @@ class LinePlot(Plot):
                     y = self.yFunc(d),
                     l = self.lFunc(d))
 
+    def _process_group_cols(self, cols : Dict[str,Any], n : int) -> Dict[str,Any]:
+        return dict(x = self.xFunc.apply_cols(cols,n),
+                    y = self.yFunc.apply_cols(cols,n),
+                    l = self.lFunc.apply_cols(cols,n))
+
     def _add_line(self, g : Group) -> dict:
         """
         Draw a line from a Group with (X,Y,LABEL) tuples as elements
@@ -280,7 +693,9 @@ class LinePlot(Plot):
         sty  = mkStyle(leg)    # get line style based on legend name
         scatr= self['scatter'] and self['scatter'][0].lower()=='t'
         mode = 'markers' if scatr else 'lines+markers'
-        return dict(x       = g['x'],
+        gl   = self['webgl'] is not None and len(g) >= int(self['webgl'])
+        return dict(type    = 'scattergl' if gl else 'scatter',
+                    x       = g['x'],
                     y       = g['y'],
                     text    = g['l'],
                     mode    = mode,
@@ -289,7 +704,12 @@ class LinePlot(Plot):
                                    color   = sty.color),
                     line    = dict(color   = sty.color,
                                    dash    = sty.line,
-                                   shape   = 'spline'))
+                                   shape   = 'linear' if gl else 'spline'))
+
+    tablecols = ['x','y','label']
+
+    def _table(self, g : Group, trace : dict) -> Dict[str,Any]:
+        return dict(x = trace['x'], y = trace['y'], label = trace['text'])
 
     def _layout(self)->dict:
         return super()._layout()
@@ -325,39 +745,117 @@ class BarPlot(Plot):
 
         self.aggFunc = avg # tell typechecker that this is the real type
 
-        if self['aggfunc']:
+        # Standard aggregations are vectorized (if the values are numbers), others are user functions
+        agg = self['aggfunc'] or 'avg'
+        self.aggname = agg if isinstance(agg,str) and agg in aggs else None
+        if not self.aggname:
             self.aggFunc = mkFunc(self['aggfunc'],funcs)  # type: ignore
 
+        # Have the DB compute partial aggregates, one row per bar, if possible
+        self.pushdown = self._pushdown
+        if self.pushdown:
+            parts      = ['_'+p for p in aggs[self.pushdown]]
+            self.xFunc = FnArgs(func = lambda *xs: dict(zip(aggs[self.pushdown],xs)),
+                                args = parts, funcs = funcs)
+
         self.seen = set() # type: set ### used to avoid plotting the same legend entries multiple times
 
-    def csv(self, pth : str) -> None:
-        '''Write plot data to a csv'''
-        raise NotImplementedError
+    @property
+    def _pushdown(self)->O[str]:
+        """
+        Name of the SQL aggregation equivalent to aggfunc, if grouping and
+        aggregation can be done in the DB: i.e. groups/subgroups are given by
+        plain columns and the value is a plain column. Disable with the
+        'pushdown' key.
+        """
+        agg    = self['aggfunc'] or 'avg'
+        custom = {'gfunc','glfunc','glcols','spfunc','slfunc','slcols','lcols','lfunc'}
+        if ('pushdown' in self and not self._flag('pushdown')) or custom & set(self.data):
+            return None
+        elif self._incremental:
+            return None
+        elif not isinstance(agg,str) or agg not in aggs:
+            return None
+        elif len(self._cols('xcols')) != 1 or self['xfunc'] not in (None,identity):
+            return None
+        return agg
 
-    def _process_group_dict(self, d : dict)->dict:
-        return d # do nothing
+    @property
+    def _partial(self)->bool:
+        """
+        Whether to keep partial aggregates per bar, rather than every value,
+        while rows are streamed in (so memory tracks the number of bars)
+        """
+        return bool(self._itersize and self.aggname and not self.pushdown
+                    and not self._flag('vectorize') and not self._incremental)
 
-    def _process_subgroup_dict(self,d:dict)->dict:
-        return dict(val = self.xFunc(d), l = self.lFunc(d))
+    def _query(self, conn : Conn, binds : list) -> str:
+        if not self.pushdown:
+            return self.base
+        cols = self._cols('gcols') + self._cols('spcols')
+        return aggregate_query(self.base, cols, self._cols('xcols')[0], self.pushdown)
+
+    def _process_group_dict(self, d : dict)->dict:
+        """
+        Evaluate the subgroup key/label along with the value, so that the raw
+        DB output need not be kept around until drawing
+        """
+        if self._partial:
+            x = self.xFunc(d)
+            if x is None or x != x: # missing or NaN
+                val = {} # type: Dict[str,Any]
+            elif isinstance(x, Number) or 'sum' in aggs[self.aggname]:
+                x   = float(x)
+                val = dict(n = 1., sum = x, sq = x*x, min = x, max = x)
+            else: # e.g. dates or strings, compared as they are
+                val = dict(n = 1., min = x, max = x)
+            return dict(val = val, sp = self.spFunc(d), sl = self.slFunc(d))
+        return dict(val = self.xFunc(d), l  = self.lFunc(d),
+                    sp  = self.spFunc(d), sl = self.slFunc(d))
+
+    def _compact(self, g : Group) -> None:
+        '''Merge the partial aggregates of each bar, if keeping them'''
+        if not self._partial:
+            return super()._compact(g)
+        codes, firsts = factorize(g['sp'])
+        p       = partials(codes, len(firsts), parts = g['val'])
+        sps,sls = g['sp'], g['sl']
+        g.elems = [dict(val = {k:v[i] for k,v in p.items()}, sp = sps[f], sl = sls[f])
+                   for i,f in enumerate(firsts)]
+
+    def _process_group_cols(self, cols : Dict[str,Any], n : int) -> Dict[str,Any]:
+        return dict(val = self.xFunc.apply_cols(cols,n), l  = self.lFunc.apply_cols(cols,n),
+                    sp  = self.spFunc.apply_cols(cols,n), sl = self.slFunc.apply_cols(cols,n))
 
     def _draw(self, g : Group) -> dict:
 
         color = mkStyle(g.rep).color
 
-        subgroups_ = self._make_groups(g.elems,self.spFunc,self.slFunc)
-        subgroups  = [sg.map(self._process_subgroup_dict) for sg in subgroups_]
-
+        # Subgroups (bars) numbered in order of first appearance
+        codes, firsts = factorize(g['sp'])
+        sls, n        = g['sl'], len(firsts)
 
-        vals = [self.aggFunc(sg['val']) for sg in subgroups]
-        color = mkStyle(g.rep).color
+        if self.pushdown or self._partial:
+            vals = aggregate(codes, n, self.aggname, parts = g['val'])
+        elif self.aggname:
+            vals = aggregate(codes, n, self.aggname, vals = g['val'])
+        else:
+            vals = [self.aggFunc(v) for v in split(codes, g['val'], n)]
 
         return dict(type = 'bar',
                     name = g.label,
-                    x    = [sg.label for sg in subgroups],
+                    x    = [sls[i] for i in firsts],
                     y    = vals,
                     )#marker = dict(color=color))
 
+    tablecols = ['x','y']
+
+    def _table(self, g : Group, trace : dict) -> Dict[str,Any]:
+        '''Aggregated value of each bar'''
+        return dict(x = trace['x'], y = trace['y'])
+
     def _layout(self)->dict:
+        from plotly.graph_objs import Layout # type: ignore
         return Layout(super()._layout(),
                       barmode = 'group')
 
@@ -367,7 +865,7 @@ class BarPlot(Plot):
 
     @property
     def kw(self)->Set[str]:
-        return super().kw | {'aggfunc','spcols','spfunc','ylab'}
+        return super().kw | {'aggfunc','spcols','spfunc','ylab','pushdown'}
 
 
 ################################################################################
@@ -377,39 +875,200 @@ class HistPlot(Plot):
     Make a histogram. Extra keywords are:
         - bins :: int
         - norm :: bool (whether or not to normalize histogram such that sum of all bars is 1)
+        - prebin :: bool (whether to bin the data before drawing, so the figure
+                          only contains bin edges and counts)
+
+    When prebinning, counts are computed by the DB if the histogram is of a
+    plain column grouped by plain columns (set 'pushdown' to false to
+    prevent this), otherwise they are computed with NumPy. Streamed
+    histograms of a plain column are counted as their rows arrive.
     """
 
     def _init(self, funcs : Dict[str,C]) -> None:
         assert 'lcols' not in self, "Cannot label data points of a histogram"
         super()._init(funcs)
-        self.bins = self['bins'] or 10
-        self.norm = self['norm'] or False
-
-    def csv(self, pth : str) -> None:
-        '''Write plot data to a csv'''
-        raise NotImplementedError
+        self.bins     = int(self['bins'] or 10)
+        self.norm     = self._flag('norm')
+        self.edges    = None # type: O[np.ndarray]
+        self.binned   = self._binned
+        self.counting = False ### count streamed rows into bins as they arrive
+
+    def query(self, conn : Conn, binds : list, funcs : dict) -> str:
+        sql = super().query(conn, binds, funcs)
+        self.counting = bool(self.binned == 'local' and self._itersize and self._plain
+                             and not self._flag('vectorize') and not self._incremental)
+        if self.counting:
+            with self.profile.stage('query'):
+                self.edges = self._edges(*self._range(conn, binds))
+                self.lims  = self.edges.tolist()
+        return sql
 
     @property
     def kw(self) -> Set[str]:
-        return super().kw | {'bins', 'norm'}
+        return super().kw | {'bins', 'norm', 'prebin', 'pushdown'}
+
+    @property
+    def _binned(self) -> O[str]:
+        '''Where the data is binned: 'sql', 'local' or None (by plotly)'''
+        if not self._flag('prebin'):
+            return None
+        return 'sql' if self._sqlbins else 'local'
+
+    @property
+    def _sqlbins(self) -> bool:
+        '''Whether the DB can count the values in each bin'''
+        custom = {'gfunc','glfunc','glcols'}
+        if ('pushdown' in self and not self._flag('pushdown')) or custom & set(self.data):
+            return False
+        elif self._incremental:
+            return False
+        return self._plain
 
-    def _process_dict(self, d : Dict) -> dict:
+    @property
+    def _plain(self) -> bool:
+        '''Whether the histogram is of a plain column (so the DB can find its range)'''
+        return len(self._cols('xcols')) == 1 and self['xfunc'] in (None,identity)
+
+    def _cheaper(self) -> bool:
+        '''Bin in the DB, even if prebin was not requested'''
+        if self.binned == 'sql' or not self._sqlbins:
+            return False
+        self.binned = 'sql'
+        return True
+
+    def _query(self, conn : Conn, binds : list) -> str:
+        if self.binned != 'sql':
+            return self.base
+        self.edges = self._edges(*self._range(conn, binds))
+        return bin_query(self.base, self._cols('gcols'), self._cols('xcols')[0],
+                         self.edges[0], self.edges[-1], self.bins)
+
+    def _range(self, conn : Conn, binds : list) -> Tuple[float,float]:
+        '''Minimum and maximum of the (plain) x column, queried from the DB'''
+        ranges = select_dict(conn, range_query(self.base, self._cols('xcols')[0]), binds)
+        los    = [r['lo'] for r in ranges if r['lo'] is not None]
+        his    = [r['hi'] for r in ranges if r['hi'] is not None]
+        return (min(los), max(his)) if los else (0., 1.)
+
+    def _bin(self, x : Any) -> int:
+        '''Index of the bin of a value (-1 if missing or out of range)'''
+        if x is None:
+            return -1
+        x = float(x)
+        if not self.lims[0] <= x <= self.lims[-1]: # also false for NaN
+            return -1
+        return min(bisect_right(self.lims, x) - 1, self.bins - 1)
+
+    def _edges(self, lo : float, hi : float) -> np.ndarray:
+        '''Bin edges spanning [lo, hi] (widened if lo == hi)'''
+        if hi <= lo:
+            hi = lo + 1
+        return np.linspace(lo, hi, self.bins + 1)
+
+    def _process_group_dict(self, d : Dict) -> dict:
+        if self.binned == 'sql':
+            return dict(b = d['_bin'] - 1, n = d['_n'])
+        elif self.counting:
+            b = self._bin(self.xFunc(d))
+            return dict(b = max(b, 0), n = float(b >= 0))
         return dict(x = self.xFunc(d))
 
+    def _compact(self, g : Group) -> None:
+        '''Replace the values counted so far with the count in each bin'''
+        if not self.counting:
+            return super()._compact(g)
+        counts  = self._counts(g)
+        g.elems = [dict(b = int(b), n = float(counts[b])) for b in np.flatnonzero(counts)]
+
+    def _process_group_cols(self, cols : Dict[str,Any], n : int) -> Dict[str,Any]:
+        if self.binned == 'sql':
+            return dict(b = cols['_bin'] - 1, n = cols['_n'])
+        return dict(x = self.xFunc.apply_cols(cols,n))
+
+    def _data(self) -> list:
+        if self.binned == 'local' and not self.counting:
+            xs = [np.asarray(g['x'],dtype=float) for g in self.groups if len(g)]
+            xs = [x[~np.isnan(x)] for x in xs]
+            xs = [x for x in xs if len(x)]
+            lo, hi = (min(x.min() for x in xs), max(x.max() for x in xs)) if xs else (0., 1.)
+            self.edges = self._edges(lo, hi)
+        return super()._data()
+
+    def _counts(self, g : Group) -> np.ndarray:
+        '''Number of elements of a group in each bin'''
+        assert self.edges is not None
+        if self.binned == 'sql' or self.counting:
+            return np.bincount(np.asarray(g['b'],dtype=int),
+                               weights   = np.asarray(g['n'],dtype=float),
+                               minlength = self.bins)[:self.bins]
+        x = np.asarray(g['x'],dtype=float)
+        return np.histogram(x[~np.isnan(x)], bins = self.edges)[0].astype(float)
+
     def _draw(self, g : Group) -> dict:
         color = mkStyle(g.label).color
 
-        start, end = min(g['x']), max(g['x'])
+        if self.binned:
+            counts = self._counts(g)
+            if self.norm and counts.sum():
+                counts = counts / counts.sum()
+            assert self.edges is not None
+            return dict(type    = 'bar',
+                        x       = (self.edges[:-1] + self.edges[1:]) / 2,
+                        y       = counts,
+                        width   = np.diff(self.edges),
+                        marker  = {'color':color},
+                        opacity = self.opacity,
+                        name    = g.label)
+
+        x = self._numeric(g)
+        if x is not None and len(x):
+            start, end = float(x.min()), float(x.max())
+            bins = dict(xbins = dict(start = start, end = end,
+                                     size  = (end - start) / self.bins or 1)) # type: Dict[str,Any]
+        else: # plotly chooses the bins, e.g. for dates or categories
+            bins = dict(nbinsx = self.bins)
 
         return dict(type     = 'histogram',
                     x        = g['x'],
-                    xbins    = dict(start = start,
-                                    end   = end,
-                                    size  = 10000000),
                     histnorm = 'probability' if self.norm else None,
                     marker   = {'color':color},
                     opacity  = self.opacity,
-                    name     = g.label)
+                    name     = g.label,
+                    **bins)
+
+    @staticmethod
+    def _numeric(g : Group) -> O[np.ndarray]:
+        '''The x values of a group as floats (missing values dropped), if numeric'''
+        try:
+            x = np.asarray(g['x'], dtype = float)
+        except (TypeError, ValueError):
+            return None
+        return x[~np.isnan(x)]
+
+    tablecols = ['lo','hi','count']
+
+    def _table(self, g : Group, trace : dict) -> Dict[str,Any]:
+        '''Count (or fraction, if normalized) of each bin [lo, hi)'''
+        if self.binned:
+            assert self.edges is not None
+            edges, counts = self.edges, trace['y']
+        elif self._numeric(g) is None: # count each distinct value
+            codes, firsts = factorize(g['x'])
+            vals   = [g['x'][i] for i in firsts]
+            counts = np.bincount(codes, minlength = len(firsts)).astype(float)
+            if self.norm and counts.sum():
+                counts = counts / counts.sum()
+            return dict(lo = vals, hi = vals, count = counts)
+        else: # the bins plotly draws
+            x      = self._numeric(g)
+            edges  = self._edges(x.min(), x.max()) if len(x) else self._edges(0., 1.)
+            counts = np.histogram(x, bins = edges)[0].astype(float)
+            if self.norm and counts.sum():
+                counts = counts / counts.sum()
+        return dict(lo = edges[:-1], hi = edges[1:], count = counts)
 
     def _layout(self)->dict:
+        from plotly.graph_objs import Layout # type: ignore
+        if self.binned:
+            return Layout(super()._layout(), bargap = 0)
         return super()._layout()
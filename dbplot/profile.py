@@ -0,0 +1,114 @@
+# External Modules
+from typing      import Any,Dict,List,Iterable,Iterator,TYPE_CHECKING,Optional as O,Callable as C
+from time        import perf_counter
+from contextlib  import contextmanager
+from collections import OrderedDict
+from json        import dumps
+if TYPE_CHECKING:
+    from logging import Logger
+'''
+Instrumentation of the stages of making a plot
+'''
+################################################################################
+Sink = C[[dict],None]
+
+class Profile(object):
+    """
+    Timers and counters for the stages of making a plot
+
+    Stage times are exclusive: time spent in a stage nested inside another is
+    not also counted towards the outer one, so the times add up to the total.
+    A Profile without sinks is disabled, skipping any per-row bookkeeping.
+    Reports are sent to the sinks by `emit`.
+    """
+    def __init__(self, *sinks : Sink) -> None:
+        self.sinks   = list(sinks)
+        self.seconds = OrderedDict() # type: Dict[str,float]
+        self.counts  = OrderedDict() # type: Dict[str,int]
+        self.groups  = []            # type: List[list] ### [label, # elements]
+        self.stack   = []            # type: List[float] ### time in child stages
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    @contextmanager
+    def stage(self, name : str) -> Iterator[None]:
+        '''Time a block of code'''
+        start = perf_counter()
+        self.stack.append(0.)
+        try:
+            yield
+        finally:
+            elapsed  = perf_counter() - start
+            children = self.stack.pop()
+            self.seconds[name] = self.seconds.get(name, 0.) + elapsed - children
+            if self.stack:
+                self.stack[-1] += elapsed
+
+    def count(self, name : str, n : int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def iterate(self, xs : Iterable, stage : str, counter : str) -> Iterator:
+        '''Time the production of each element of an iterable, and count them'''
+        it, n = iter(xs), 0
+        try:
+            while True:
+                with self.stage(stage):
+                    try:
+                        x = next(it)
+                    except StopIteration:
+                        return
+                n += 1
+                yield x
+        finally:
+            self.count(counter, n)
+
+    def report(self) -> dict:
+        return dict(seconds = dict(self.seconds),
+                    total   = sum(self.seconds.values()),
+                    counts  = dict(self.counts),
+                    groups  = self.groups)
+
+    def emit(self, **meta : Any) -> dict:
+        '''Send the report (with extra `meta` fields) to every sink'''
+        rep = dict(meta, **self.report())
+        for sink in self.sinks:
+            sink(rep)
+        return rep
+
+################################################################################
+# Sinks
+#------
+def breakdown(rep : dict) -> str:
+    '''Human readable summary of a report'''
+    total = rep['total'] or 1.
+    head  = ' '.join('%s=%s' % (k,v) for k,v in rep.items()
+                     if k not in ['seconds','total','counts','groups'])
+    lines = [head + ' (%.3fs)' % rep['total']]
+    for k,v in sorted(rep['seconds'].items(), key = lambda kv: -kv[1]):
+        lines.append('    %-10s %9.3fs %5.1f%%' % (k, v, 100 * v / total))
+    for k,n in rep['counts'].items():
+        lines.append('    %-10s %10d' % (k, n))
+    groups = rep['groups']
+    if groups:
+        sizes = [n for _,n in groups]
+        lines.append('    %-10s %10d (sizes %d-%d)' % ('groups', len(groups), min(sizes), max(sizes)))
+    return '\n'.join(lines)
+
+def print_sink(rep : dict) -> None:
+    print(breakdown(rep))
+
+def log_sink(logger : O['Logger'] = None) -> Sink:
+    '''Log reports (as JSON) at INFO level (to the 'dbplot' logger by default)'''
+    if logger is None:
+        from logging import getLogger
+        logger = getLogger('dbplot')
+    return lambda rep: logger.info(dumps(rep, default = str))
+
+def json_sink(pth : str) -> Sink:
+    '''Append reports to a file, one JSON object per line'''
+    def sink(rep : dict) -> None:
+        with open(pth, 'a') as f:
+            f.write(dumps(rep, default = str) + '\n')
+    return sink
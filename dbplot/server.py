@@ -0,0 +1,177 @@
+# External Modules
+from typing         import Any,Dict,Tuple
+from os             import environ,remove
+from os.path        import join,exists,isfile,getmtime,realpath,commonpath
+from json           import loads
+from threading      import BoundedSemaphore,Lock
+from argparse       import ArgumentParser
+from http.server    import BaseHTTPRequestHandler,ThreadingHTTPServer
+from socketserver   import ThreadingMixIn,UnixStreamServer
+from plotly.io      import to_html,to_json # type: ignore
+# Internal Modules
+from dbplot.plot    import Plot
+from dbplot.db      import ConnectInfo,ResultCache,from_file
+from dbplot.misc    import path_to_funcs,load
+from dbplot.output  import encode
+
+"""
+Long-running dbplot service, which keeps DB connections, query results and
+user functions warm between requests
+
+Serves HTTP (on a TCP port or a Unix socket):
+    GET  /health -> 'ok'
+    POST /render -> HTML (or figure JSON) for a JSON request with keys
+            plot   :: name of a spec in the --pltpth directory
+            args   :: overrides for cosmetic keys of the spec (see `argkeys`)
+            binds  :: binds for a parameterized query
+            format :: 'html' (default) or 'json'
+
+Specs are evaluated (their functions) and run (their SQL), so only those in
+the plot directory are served, requests must be sent as application/json
+(which a web page cannot do without the server's consent), and only cosmetic
+keys may be overridden.
+
+>>> python -m dbplot.server --db db.json --pltpth plots/ --funcs f.py --port 8050
+"""
+################################################################################
+# Spec keys a request may override: none are evaluated or sent to the DB
+argkeys = {'title','xlab','ylab','frame','square','scatter',
+           'maxpoints','decimate','webgl','bins','norm'}
+
+class Renderer(object):
+    """
+    Shared state of the service: connection info (with its pool and result
+    cache), user functions and plot specs (re-read when modified)
+    """
+    def __init__(self, db : ConnectInfo, funcs : Dict[str,Any], pltdir : str, jobs : int) -> None:
+        self.db     = db
+        self.funcs  = funcs
+        self.pltdir = pltdir
+        self.slots  = BoundedSemaphore(jobs)
+        self.specs  = {} # type: Dict[str,Tuple[float,dict]]
+        self.lock   = Lock()
+        db.maxconn  = max(db.maxconn, jobs)
+
+    def spec(self, name : str) -> dict:
+        '''Plot spec by name (relative to pltdir, with or without .json)'''
+        assert isinstance(name, str), 'Plot name must be a string'
+        root = realpath(self.pltdir)
+        pths = [realpath(join(root, name + ext)) for ext in ('', '.json')]
+        pth  = next((p for p in pths if isfile(p)), '')
+        assert pth and commonpath([root, pth]) == root, 'No plot spec %r in %s' % (name, self.pltdir)
+        mtime = getmtime(pth)
+        with self.lock:
+            if pth not in self.specs or self.specs[pth][0] != mtime:
+                with open(pth,'r') as f:
+                    self.specs[pth] = (mtime, load(f))
+            return dict(self.specs[pth][1])
+
+    def render(self, req : dict) -> Tuple[bytes,str]:
+        '''Content and content type responding to a render request'''
+        assert isinstance(req, dict), 'Request must be an object'
+        assert 'spec' not in req, 'Inline specs are not served: name a spec in the plot directory'
+        args = req.get('args') or {}
+        assert isinstance(args, dict), 'args must be an object'
+        bad  = set(args) - argkeys
+        assert not bad, 'Only cosmetic keys may be overridden, not %s' % sorted(bad)
+        spec = self.spec(req['plot'])
+        spec.update(args)
+        typ  = spec.pop('type').lower()
+        p    = Plot.pltdict()[typ](**spec)
+
+        binds = req.get('binds') or []
+        if not isinstance(binds,list):
+            binds = [binds]
+
+        fig = p.fig(conn = self.db, binds = binds, funcs = self.funcs).to_dict()
+        if req.get('format','html') == 'json':
+            return to_json(encode(fig), validate = False).encode(), 'application/json'
+        html = to_html(fig, include_plotlyjs = 'cdn', include_mathjax = 'cdn', validate = False)
+        return html.encode(), 'text/html; charset=utf-8'
+
+class Handler(BaseHTTPRequestHandler):
+    renderer = None # type: Renderer
+    timeout  = 600  # seconds to wait for a free rendering slot
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def _send(self, code : int, body : bytes, ctype : str = 'text/plain') -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == '/health':
+            self._send(200, b'ok')
+        else:
+            self._send(404, b'Not found')
+
+    def do_POST(self) -> None:
+        if self.path != '/render':
+            return self._send(404, b'Not found')
+        if self.headers.get_content_type() != 'application/json':
+            return self._send(415, b'Requests must be sent as application/json')
+        try:
+            n   = int(self.headers.get('Content-Length') or 0)
+            req = loads(self.rfile.read(n) or b'{}')
+        except ValueError as e:
+            return self._send(400, ('Bad request: %s' % e).encode())
+
+        if not self.renderer.slots.acquire(timeout = self.timeout):
+            return self._send(503, b'Too busy')
+        try:
+            body, ctype = self.renderer.render(req)
+        except (AssertionError, KeyError) as e:
+            return self._send(400, ('Bad request: %r' % e).encode())
+        except Exception as e:
+            return self._send(500, ('Failed to render: %r' % e).encode())
+        finally:
+            self.renderer.slots.release()
+        self._send(200, body, ctype)
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+################################################################################
+parser = ArgumentParser(description = 'Serve dbplot figures from a warm process')
+
+parser.add_argument('--db',       default = '', type = str, help = 'Path to JSON file with connection info')
+parser.add_argument('--funcs',    default = [], type = str.split, help = 'Space-separated list of paths to python files binding functions to names')
+parser.add_argument('--pltpth',   default = '', type = str, help = 'Directory of JSON plot specs (the only ones served)')
+parser.add_argument('--host',     default = '127.0.0.1', type = str, help = 'Interface to listen on')
+parser.add_argument('--port',     default = 8050, type = int, help = 'TCP port to listen on')
+parser.add_argument('--socket',   default = '', type = str, help = 'Listen on this Unix socket instead of TCP')
+parser.add_argument('--jobs',     default = 4, type = int, help = 'Maximum number of figures rendered at once')
+parser.add_argument('--cachedir', default = '', type = str, help = 'Directory to persist cached query results in')
+parser.add_argument('--cachettl', default = 300., type = float, help = 'Seconds for which query results are reused')
+
+def serve(args : dict) -> None:
+    assert args['pltpth'] and exists(args['pltpth']), 'The server needs a --pltpth directory of specs'
+    db = from_file(args.get('db') or environ['DB_JSON'])
+    db.cache = ResultCache(pth = args['cachedir'], ttl = args['cachettl'])
+
+    funcs = {} # type: Dict[str,Any]
+    for fncpth in args['funcs']:
+        funcs.update(path_to_funcs(fncpth))
+
+    Handler.renderer = Renderer(db, funcs, args['pltpth'], args['jobs'])
+    sock = args.get('socket')
+    if sock:
+        if exists(sock):
+            remove(sock)
+        server = UnixHTTPServer(sock, Handler) # type: Any
+    else:
+        server = ThreadingHTTPServer((args['host'], args['port']), Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        db.close()
+
+if __name__ == '__main__':
+    serve(vars(parser.parse_args()))
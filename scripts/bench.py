@@ -0,0 +1,188 @@
+# External Modules
+from typing          import Any,Dict,List,Iterator,Tuple
+from argparse        import ArgumentParser
+from json            import dumps
+from random          import Random
+from resource        import getrusage,RUSAGE_SELF
+from multiprocessing import get_context
+import sys
+# Internal Modules
+from dbplot.db      import ConnectInfo
+from dbplot.parse   import StoreDictKeyPair
+from dbplot.profile import Profile
+
+"""
+Benchmark the query-to-figure pipeline
+
+For each plot type and table size a fresh process runs Plot.fig and
+serializes the figure to HTML, recording the Plot's Profile (time per stage,
+row and function call counts), peak RSS and the size of the HTML. Rows come from an in-process fake DB by default, or
+from a synthetic table in a real (throwaway) Postgres DB with --db.
+
+>>> PYTHONPATH=. python scripts/bench.py --rows 1e3 1e5 --groups 1 100 --out bench.json
+"""
+################################################################################
+table = 'dbplot_bench'
+
+specs = {'line' : dict(xcols = 'job_id', ycols  = 'value', gcols = 'user'),
+         'bar'  : dict(xcols = 'value',  gcols  = 'user',  spcols = 'kind'),
+         'hist' : dict(xcols = 'value',  gcols  = 'user',  prebin = True)
+        } # type: Dict[str,Dict[str,Any]]
+
+def rows(n : int, ngroups : int, seed : int = 0) -> Iterator[dict]:
+    '''Synthetic job table: `ngroups` users, 10 kinds of job'''
+    rand = Random(seed)
+    for i in range(n):
+        yield dict(job_id    = i,
+                   timestamp = 1.5e9 + 60. * i,
+                   user      = 'user%d' % (i % ngroups),
+                   kind      = 'kind%d' % (i % 10),
+                   value     = rand.gauss(0, 1))
+
+################################################################################
+class FakeCursor(object):
+    '''
+    Ignores the query, returning the synthetic table (except for the range
+    query of a histogram, which is answered for the value column)
+    '''
+    def __init__(self, n : int, ngroups : int) -> None:
+        self.n = n; self.ngroups = ngroups; self.itersize = 2000; self.q = ''
+
+    def __enter__(self) -> 'FakeCursor': return self
+    def __exit__(self, *args : Any) -> None: pass
+    def __iter__(self) -> Iterator[dict]:
+        if self.q.startswith('SELECT MIN('):
+            vals = [r['value'] for r in rows(self.n, self.ngroups)] or [0.]
+            return iter([dict(lo = min(vals), hi = max(vals))])
+        return rows(self.n, self.ngroups)
+
+    def execute(self, q : str, vars : list = []) -> None: self.q = q
+    def fetchall(self) -> List[dict]: return list(self)
+
+class FakeConnection(object):
+    def __init__(self, n : int, ngroups : int) -> None:
+        self.n = n; self.ngroups = ngroups; self.closed = 0; self.autocommit = True
+
+    def cursor(self, *args : Any, **kwargs : Any) -> FakeCursor:
+        return FakeCursor(self.n, self.ngroups)
+
+    def rollback(self) -> None: pass
+    def close(self) -> None: self.closed = 1
+
+class FakeConnectInfo(ConnectInfo):
+    '''In-process stand-in for a DB whose every query returns the synthetic table'''
+    def __init__(self, n : int, ngroups : int) -> None:
+        super().__init__(user = 'bench', db = 'bench', copyrows = 0) # no EXPLAIN or COPY
+        self.n = n; self.ngroups = ngroups
+
+    def connect(self, attempt : int = 3) -> Any:
+        return FakeConnection(self.n, self.ngroups)
+
+################################################################################
+def mktable(db : ConnectInfo, n : int, ngroups : int) -> None:
+    '''(Re)create the synthetic table in a real DB'''
+    q = '''CREATE TABLE {0} AS
+           SELECT i AS job_id, 1.5e9 + 60 * i AS timestamp,
+                  'user' || (i %% %s) AS "user", 'kind' || (i %% 10) AS kind,
+                  random() AS value
+           FROM generate_series(0, %s - 1) AS i'''.format(table)
+    with db.borrow() as c, c.cursor() as cxn:
+        cxn.execute('DROP TABLE IF EXISTS ' + table)
+        cxn.execute(q, [ngroups, n])
+
+def droptable(db : ConnectInfo) -> None:
+    with db.borrow() as c, c.cursor() as cxn:
+        cxn.execute('DROP TABLE IF EXISTS ' + table)
+
+def case(typ : str, n : int, ngroups : int, dbpth : str, extra : dict) -> dict:
+    '''Run one benchmark case (in a fresh process)'''
+    from plotly.io import to_html # type: ignore
+    import dbplot.plot as plot
+
+    if dbpth:
+        db = ConnectInfo.from_file(dbpth) # type: ConnectInfo
+        mktable(db, n, ngroups)
+        spec = dict(specs[typ], query = 'SELECT * FROM ' + table, **extra)
+    else:
+        db   = FakeConnectInfo(n, ngroups)
+        # the fake DB cannot run rewritten queries (only line plots have none)
+        off  = {} if typ == 'line' else dict(pushdown = False)
+        spec = dict(specs[typ], query = table, **dict(off, **extra))
+
+    p = plot.Plot.pltdict()[typ](**spec)
+    reports = [] # type: List[dict]
+    p.profile = Profile(reports.append)
+    try:
+        fig = p.fig(conn = db, binds = [], funcs = {})
+        with p.profile.stage('serialize'):
+            html = to_html(fig, include_plotlyjs = False)
+    finally:
+        if dbpth:
+            droptable(db)
+        db.close()
+
+    return p.profile.emit(type     = typ,
+                          rows     = n,
+                          groups   = ngroups,
+                          spec     = {k:v for k,v in spec.items() if k != 'query'},
+                          maxrss   = getrusage(RUSAGE_SELF).ru_maxrss * 1024, # Linux: kB
+                          htmlsize = len(html.encode()))
+
+def run(cases : List[Tuple[str,int,int,str,dict]]) -> List[dict]:
+    '''Run each case in its own process, so that peak RSS is per case'''
+    out = [] # type: List[dict]
+    with get_context('spawn').Pool(1, maxtasksperchild = 1) as pool:
+        for c in cases:
+            res = pool.apply(case, c)
+            print(dumps(res), file = sys.stderr)
+            out.append(res)
+    return out
+
+################################################################################
+parser = ArgumentParser(description = 'Benchmark the query-to-figure pipeline')
+
+parser.add_argument('--types',
+                    default = sorted(specs),
+                    nargs   = '+',
+                    choices = sorted(specs),
+                    help    = 'Plot types to benchmark')
+
+parser.add_argument('--rows',
+                    default = [1e3,1e4,1e5],
+                    nargs   = '+',
+                    type    = float,
+                    help    = 'Table sizes (up to 1e7)')
+
+parser.add_argument('--groups',
+                    default = [1,100],
+                    nargs   = '+',
+                    type    = int,
+                    help    = 'Number of distinct gcols values')
+
+parser.add_argument('--db',
+                    default = '',
+                    type    = str,
+                    help    = 'JSON connection info for a scratch Postgres DB (default: fake DB)')
+
+parser.add_argument('--out',
+                    default = '',
+                    type    = str,
+                    help    = 'Write results to this JSON file (default: stdout)')
+
+parser.add_argument('--spec',
+                    default = {},
+                    action  = StoreDictKeyPair,
+                    nargs   = '+',
+                    metavar = 'KEY=VAL',
+                    help    = 'Extra plot keys for every case, e.g. vectorize=true')
+
+if __name__ == '__main__':
+    args  = parser.parse_args()
+    cases = [(t, int(n), g, args.db, args.spec)
+             for t in args.types for n in args.rows for g in args.groups]
+    res   = dumps(run(cases), indent = 2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(res)
+    else:
+        print(res)
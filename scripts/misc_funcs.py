@@ -1,7 +1,6 @@
 # External modules
 from typing import List,Tuple,Optional as O,Callable as C
 import json
-import scipy.stats.mstats as mstatt   # type: ignore
 import numpy as np   # type: ignore
 from math import log 
 
@@ -121,6 +120,7 @@ def absavg(xs:list)->float:
 def RMS(xs:list)->float:
     return (avg([x**2 for x in xs]))**(0.5)
 def gMeanAbs(xs:list)->float:
+    import scipy.stats.mstats as mstatt   # type: ignore ### slow to import
     preProcessed = [abs(x) for x in xs if x!=0]
     return mstatt.gmean(preProcessed)
 
@@ -0,0 +1,127 @@
+# External modules
+from typing import Dict,Tuple,Any,Callable as C
+import numpy as np   # type: ignore
+
+################################################################################
+"""
+Vectorised equivalents of the functions in misc_funcs.py, on NumPy arrays
+
+Post-processing functions take and return the columns of a line, a dict of
+arrays with keys x, y and l (sorted by x), and are used with LinePlot's `post`
+key, e.g. "post": ["min_y", "absdiff"] with --funcs scripts/misc_funcs_np.py
+
+Groupby and label functions are applied per row, so are not repeated here:
+use misc_funcs.py for them.
+"""
+Cols = Dict[str,np.ndarray]
+
+def take(cols:Cols,inds:Any)->Cols:
+    return {k:np.asarray(v)[inds] for k,v in cols.items()}
+
+def nx(cols:Cols)->int:
+    '''Number of distinct x values'''
+    return len(np.unique(cols['x']))
+
+######################
+# PostProcessing Funcs
+# --------------------
+def min2(cols:Cols)->Cols:
+    """
+    DON'T include a line if it has only one point
+    """
+    return cols if nx(cols) >= 2 else take(cols,slice(0,0))
+
+def min_y(cols:Cols)->Cols:
+    """
+    keep the data point with the minimum y value for each x (the first, if
+    tied), in order of first appearance of x
+    """
+    y = np.asarray(cols['y'],dtype=float)
+    _, firsts, inv = np.unique(cols['x'],return_index=True,return_inverse=True)
+    order  = np.lexsort((np.arange(len(y)),y,inv)) # by x, then y, then position
+    starts = np.flatnonzero(np.r_[True,inv[order][1:] != inv[order][:-1]]) if len(y) else []
+    return take(cols,order[starts][np.argsort(firsts)])
+
+def absolute(cols:Cols)->Cols:
+    return dict(cols,y=np.abs(cols['y']))
+
+def absdiff(cols:Cols)->Cols:
+    """
+    Take the last y datapoint of a line to be 0, all previous y values replaced with distance to final ('converged') value
+    """
+    if nx(cols) < 2: return take(cols,slice(0,0))
+    y = np.asarray(cols['y'],dtype=float)
+    return dict(cols,y=np.abs(y - y[-1]))
+
+def derivabsdiff(cols:Cols)->Cols:
+    return deriv(absdiff(cols)) #derivative of the above 'absdiff' curve
+
+def deriv(cols:Cols)->Cols:
+    if nx(cols) < 3: return take(cols,slice(0,0))
+    _, dydx = derivxy(cols['x'],cols['y'])
+    return dict(take(cols,slice(1,-1)),y=dydx)
+
+def derivxy(x:Any,y:Any)->Tuple[np.ndarray,np.ndarray]:
+    """
+    Converts x and y vectors (length N) to a pair of X and dYdX vectors (length N-2)
+    Uses the three-point finite difference estimate of the derivative for
+    non-uniform spacing, which is np.gradient's for interior points
+    """
+    x,y = np.asarray(x,dtype=float),np.asarray(y,dtype=float)
+    if len(x) != len(np.unique(x)):
+        raise ValueError("EQ constraint poorly chosen for derivative: multiple y values per x value:"+str(list(zip(x,y))))
+    if len(x) < 3:
+        return x[:0],y[:0]
+    return x[1:-1],np.gradient(y,x)[1:-1]
+
+##################################################
+# Bar Aggregating Function [(a,b,c,...)] -> Float
+#---------------------------------------------
+def _mean(a:np.ndarray)->float:
+    if not len(a): raise ZeroDivisionError('division by zero')
+    return float(a.mean())
+
+def avg(xs:Any)->float:
+    return _mean(np.asarray(xs,dtype=float))
+def avgNone(xs:Any)->float:
+    a = np.asarray(xs,dtype=float) # None -> NaN
+    return _mean(a[~np.isnan(a)])
+def absavg(xs:Any)->float:
+    return _mean(np.abs(np.asarray(xs,dtype=float)))
+def RMS(xs:Any)->float:
+    return _mean(np.asarray(xs,dtype=float)**2)**(0.5)
+def gMeanAbs(xs:Any)->float:
+    a = np.abs(np.asarray(xs,dtype=float))
+    return float(np.exp(np.log(a[a!=0]).mean())) # geometric mean, without scipy
+
+def converged(ycols:str,average:bool=False)->C:
+    xcol,ycol = ycols.split()
+
+    derivConvDict={'pw':
+                    {'raw_energy':        (0.001,200)
+                    ,'error_BM':        (100,200)
+                    ,'error_lattice_A':    (0.001,300)}}
+    dydxMax,xRange = derivConvDict[xcol][ycol]  # threshold for max |dy/dx| /// range (from last data point) over which |dy/dx| must be decreasing and beneath threshold
+
+    def convergenceFunc(xys:Any)->float:
+        #Tests whether or not yFunc derivative has a low magnitude and is decreasing over a certain range
+        print('\t\t\tTesting for convergence between %s and %s'%(xcol,ycol))
+
+        xy = np.asarray(list(xys),dtype=float).reshape(-1,2)
+        if average:
+            xs,inv = np.unique(xy[:,0],return_inverse=True)
+            ys     = np.bincount(inv,weights=xy[:,1]) / np.bincount(inv)
+        else:
+            xs,ys  = xy[:,0],xy[:,1]
+        if len(xs) < 5: print("\t\t\t\tNot enough data points"); return 0 # not converged
+
+        xmax    = xs[-2]
+        x,dydx  = derivxy(xs,ys)
+        ok      = (-dydxMax <= dydx) & (dydx <= dydxMax/10.) # allow *tiny* positive derivatives in case line is basically flat
+        suffix  = np.logical_and.accumulate(ok[::-1])[::-1]  # all ok from here to the end
+        if suffix.any():
+            i = int(np.argmax(suffix))
+            return x[i] if xmax-x[i] >= xRange else 0
+        print('\t\t\t\t\tDerivative not below threshold (%s-%s) within range (%s-%s)'%(-dydxMax,0.0001,xmax-xRange,xmax))
+        return 0
+    return convergenceFunc
@@ -0,0 +1,71 @@
+# External Modules
+from typing     import Dict,List
+from argparse   import ArgumentParser
+from json       import dumps,loads
+from statistics import median
+from subprocess import run,PIPE
+from time       import perf_counter
+import sys
+
+"""
+Check the start up cost of the CLI against a budget
+
+Measures (in fresh interpreters) the time to import dbplot.main and to run
+`dbplot.main --help`, and checks that no heavy dependency is imported just to
+start. Exits nonzero if the budget is exceeded, so it can run in CI.
+
+>>> PYTHONPATH=. python scripts/startup.py --budget 100
+"""
+################################################################################
+heavy = ['numpy','plotly','psycopg2','jinja2','scipy','pandas','pyarrow',
+         'dbplot.plot','distutils'] # type: List[str]
+
+probe = '''
+import sys, json
+from time import perf_counter
+start = perf_counter()
+import dbplot.main
+print(json.dumps(dict(ms = 1000 * (perf_counter() - start),
+                      heavy = [m for m in %r if m in sys.modules])))
+''' % heavy
+
+def importtime(runs : int) -> Dict[str,list]:
+    '''Median time (ms) to import dbplot.main, and the heavy modules it loaded'''
+    res = [loads(run([sys.executable, '-c', probe], stdout = PIPE, check = True).stdout)
+           for _ in range(runs)]
+    return dict(ms = median(r['ms'] for r in res), heavy = res[0]['heavy'])
+
+def helptime(runs : int) -> float:
+    '''Median wall time (ms) of `python -m dbplot.main --help`, interpreter included'''
+    times = [] # type: List[float]
+    for _ in range(runs):
+        start = perf_counter()
+        run([sys.executable, '-m', 'dbplot.main', '--help'], stdout = PIPE, check = True)
+        times.append(1000 * (perf_counter() - start))
+    return median(times)
+
+################################################################################
+parser = ArgumentParser(description = 'Check the start up cost of the CLI')
+
+parser.add_argument('--runs',
+                    default = 5,
+                    type    = int,
+                    help    = 'Number of fresh interpreters to time')
+
+parser.add_argument('--budget',
+                    default = 100.,
+                    type    = float,
+                    help    = 'Maximum milliseconds to import dbplot.main')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    imp  = importtime(args.runs)
+    res  = dict(import_ms = round(imp['ms'], 1),
+                help_ms   = round(helptime(args.runs), 1),
+                heavy     = imp['heavy'],
+                budget_ms = args.budget)
+    print(dumps(res))
+    if imp['heavy']:
+        raise SystemExit('Heavy modules imported at start up: %s' % ', '.join(imp['heavy']))
+    if imp['ms'] > args.budget:
+        raise SystemExit('Importing dbplot.main took %.1fms (budget %.1fms)' % (imp['ms'], args.budget))
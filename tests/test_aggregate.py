@@ -0,0 +1,40 @@
+# External Modules
+from datetime import date
+import numpy as np # type: ignore
+# Internal Modules
+from dbplot.misc import aggregate, factorize
+'''
+Aggregation of BarPlot values (see misc.aggregate)
+'''
+################################################################################
+
+def bars(keys : list, vals : list, agg : str) -> list:
+    codes, firsts = factorize(keys)
+    return aggregate(codes, len(firsts), agg, vals = vals)
+
+def test_numeric() -> None:
+    assert bars(['a','b','a'], [1, 2, 3], 'avg') == [2., 2.]
+    assert bars(['a','b','a'], [1, None, 3], 'max') == [3., None]
+
+def test_dates() -> None:
+    vals = [date(2020,1,5), date(2020,1,2), None]
+    assert bars(['a','a','b'], vals, 'max') == [date(2020,1,5), None]
+    assert bars(['a','a','b'], vals, 'min') == [date(2020,1,2), None]
+    assert bars(['a','a','b'], vals, 'count') == [2., 0.]
+
+def test_text() -> None:
+    assert bars(['a','a','b'], ['n4','n10','x'], 'max') == ['n4','x']
+    assert bars(['a','a'], ['8','18'], 'max') == ['8'] # compared as strings
+    assert bars(['a','a'], np.array(['8','18'], dtype = object), 'min') == ['18']
+
+def test_parts() -> None:
+    '''Partial aggregates, e.g. computed by the DB, merged per bar'''
+    parts = [dict(n = 2, max = date(2020,1,5)), dict(n = 1, max = date(2020,1,9)),
+             dict(n = 0, max = None)]
+    codes = np.array([0, 0, 1])
+    assert aggregate(codes, 2, 'max', parts = parts) == [date(2020,1,9), None]
+    assert aggregate(codes, 2, 'count', parts = parts) == [3., 0.]
+    parts = [dict(min = 'n4'), dict(min = 'n10')]
+    assert aggregate(np.array([0, 0]), 1, 'min', parts = parts) == ['n10']
+    parts = [dict(n = 1, sum = 2., min = 2.), dict(n = 1, sum = 5., min = 5.)]
+    assert aggregate(np.array([0, 0]), 1, 'min', parts = parts) == [2.]